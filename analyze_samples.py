@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+
+"""
+Script to analyze a recorded sampling run on this computer, after the run. Record one with
+`python3 telemetry_viewer.py -record run.csv` while the program runs on the robot.
+
+Usage: python3 analyze_samples.py FILE.csv [-target HZ | NAME=HZ ...] [-gap FACTOR] [-out FOLDER]
+
+For every sensor, it reports:
+- the achieved sampling rate, and how it compares to the target rate if one is given
+- the distribution of the intervals between samples, whose spread is the jitter
+- the gaps, intervals longer than FACTOR times the median interval of the sensor
+- the latency from the robot to this computer, relative to the fastest sample, since the clocks of
+  the robot and of this computer are not synchronized
+
+and, for every pair of sensors, the timing skew: how far apart in time the closest samples of the
+two sensors are. The report is printed and written to FOLDER/report.txt and FOLDER/report.json,
+with plots of the interval distributions and of the rate over time.
+
+The file needs the columns time, sensor, and value, and may have received and index columns
+(for sensors with several values, only index 0 is analyzed). Everything is computed with
+whole-column NumPy/pandas operations, so a million samples take seconds.
+
+Samples that the telemetry sender dropped (see TelemetrySender.dropped) show up as gaps too.
+"""
+
+from __future__ import annotations  # not required in Python 3.10+
+from argparse import ArgumentParser
+from itertools import combinations
+import json
+import os
+
+import matplotlib
+matplotlib.use("Agg")  # only write files, no window
+from matplotlib import pyplot as plt
+import numpy as np
+import pandas as pd
+
+
+GAP_FACTOR = 3  # intervals longer than this many median intervals are gaps
+MAX_GAPS_LISTED = 10  # longest gaps listed in the report
+RATE_BIN = 0.5  # seconds per point in the rate over time plot
+
+
+def load_samples(path: str) -> pd.DataFrame:
+    "Return the samples of the file, with one row per sample, sorted by sensor then time."
+    samples = pd.read_csv(path, dtype={"time": "f8", "received": "f8", "sensor": "category", "index": "u1"},
+                          engine="c")
+    if "index" in samples:
+        samples = samples[samples["index"] == 0]  # values of one sample share its time
+    return samples.sort_values(["sensor", "time"], kind="stable", ignore_index=True)
+
+
+def parse_targets(targets: list[str], sensors: list[str]) -> dict[str, float]:
+    "Return the target rate of each sensor from arguments like 100 (for every sensor) or Ultrasonic=20."
+    rates = {}
+    for target in targets:
+        name, _, rate = target.rpartition("=")
+        for sensor in sensors:
+            if not name or name.lower() in sensor.lower():
+                rates[sensor] = float(rate)
+    return rates
+
+
+def add_intervals(samples: pd.DataFrame):
+    "Add the interval column: seconds since the previous sample of the same sensor, NaN for the first one."
+    intervals = samples["time"].diff()
+    first = samples["sensor"].ne(samples["sensor"].shift())  # rows are sorted by sensor
+    samples["interval"] = intervals.mask(first)
+
+
+def sensor_stats(samples: pd.DataFrame, targets: dict[str, float], gaps: pd.DataFrame) -> pd.DataFrame:
+    "Return the rate, interval, gap, and latency statistics of each sensor, one row per sensor."
+    by_sensor = samples.groupby("sensor", observed=True)
+    times = by_sensor["time"]
+    stats = pd.DataFrame({"samples": times.size(), "duration_s": times.max() - times.min()})
+    stats["rate_hz"] = (stats["samples"] - 1) / stats["duration_s"]
+    stats["target_hz"] = pd.Series(targets, dtype="f8").reindex(stats.index)
+    stats["rate_ratio"] = stats["rate_hz"] / stats["target_hz"]
+
+    intervals = by_sensor["interval"]
+    stats["interval_mean_ms"] = intervals.mean() * 1e3
+    stats["jitter_ms"] = intervals.std() * 1e3
+    quantiles = intervals.quantile([0.5, 0.9, 0.99]).unstack() * 1e3
+    stats[["interval_p50_ms", "interval_p90_ms", "interval_p99_ms"]] = quantiles.to_numpy()
+    stats["interval_max_ms"] = intervals.max() * 1e3
+
+    by_gap = gaps.groupby("sensor", observed=True)["duration_s"]
+    stats["gaps"] = by_gap.size().reindex(stats.index, fill_value=0)
+    stats["gap_time_s"] = by_gap.sum().reindex(stats.index, fill_value=0.0)
+
+    if "received" in samples:
+        latency = samples["received"] - samples["time"]
+        latency = (latency - latency.groupby(samples["sensor"], observed=True).transform("min")) * 1e3
+        by_latency = latency.groupby(samples["sensor"], observed=True)
+        stats["latency_p50_ms"] = by_latency.median()
+        stats["latency_p99_ms"] = by_latency.quantile(0.99)
+    return stats
+
+
+def find_gaps(samples: pd.DataFrame, gap_factor: float = GAP_FACTOR) -> pd.DataFrame:
+    """
+    Return the gaps, intervals longer than gap_factor times the median interval of their sensor,
+    longest first. start_s is the start of the gap in seconds since the first sample of the run.
+    """
+    median = samples.groupby("sensor", observed=True)["interval"].transform("median")
+    gaps = samples[samples["interval"] > gap_factor * median]
+    return pd.DataFrame({"sensor": gaps["sensor"], "start_s": gaps["time"] - gaps["interval"] - samples["time"].min(),
+                         "duration_s": gaps["interval"]}).sort_values("duration_s", ascending=False)
+
+
+def timing_skew(samples: pd.DataFrame) -> pd.DataFrame:
+    """
+    Return, for each pair of sensors, how far in time each sample of the first sensor is from the
+    closest sample of the second one, one row per pair.
+    """
+    times = {sensor: group["time"].to_numpy() for sensor, group in samples.groupby("sensor", observed=True)}
+    rows = []
+    for first, second in combinations(times, 2):
+        a, b = times[first], times[second]
+        if len(a) == 0 or len(b) == 0:
+            continue
+        after = np.clip(np.searchsorted(b, a), 1, len(b) - 1) if len(b) > 1 else np.zeros(len(a), dtype=int)
+        before = after - 1 if len(b) > 1 else after
+        skew = np.minimum(np.abs(a - b[before]), np.abs(b[after] - a))
+        rows.append({"sensors": f"{first} / {second}", "skew_p50_ms": np.median(skew) * 1e3,
+                     "skew_p99_ms": np.quantile(skew, 0.99) * 1e3, "skew_max_ms": skew.max() * 1e3})
+    return pd.DataFrame(rows, columns=["sensors", "skew_p50_ms", "skew_p99_ms", "skew_max_ms"])
+
+
+def format_report(stats: pd.DataFrame, gaps: pd.DataFrame, skew: pd.DataFrame) -> str:
+    "Return the report as text."
+    with pd.option_context("display.width", 200, "display.max_columns", None, "display.float_format", "{:.3f}".format):
+        report = ["Per sensor:", stats.T.to_string(), ""]
+        if len(gaps):
+            report += [f"Longest gaps (of {len(gaps)}):", gaps.head(MAX_GAPS_LISTED).to_string(index=False), ""]
+        else:
+            report += ["No gaps.", ""]
+        if len(skew):
+            report += ["Timing skew between sensors:", skew.to_string(index=False), ""]
+    return "\n".join(report)
+
+
+def plot(samples: pd.DataFrame, out: str):
+    "Write the interval distribution and the rate over time of each sensor as PNG files."
+    figure, axes = plt.subplots()
+    for sensor, group in samples.groupby("sensor", observed=True):
+        intervals = group["interval"].dropna().to_numpy() * 1e3
+        intervals = intervals[intervals > 0]
+        if len(intervals):
+            bins = np.logspace(np.log10(intervals.min()), np.log10(intervals.max()) + 1e-9, 100)
+            axes.hist(intervals, bins=bins, histtype="step", label=str(sensor))
+    axes.set(xscale="log", yscale="log", xlabel="Interval between samples (ms)", ylabel="Samples",
+             title="Interval distribution")
+    axes.legend()
+    figure.savefig(os.path.join(out, "intervals.png"), dpi=120)
+
+    figure, axes = plt.subplots()
+    start = samples["time"].min()
+    for sensor, group in samples.groupby("sensor", observed=True):
+        times = group["time"].to_numpy() - start
+        counts, edges = np.histogram(times, bins=np.arange(0, times.max() + RATE_BIN, RATE_BIN))
+        axes.plot(edges[:-1], counts / RATE_BIN, label=str(sensor))
+    axes.set(xlabel="Time since start (s)", ylabel="Rate (Hz)", title="Sampling rate over time")
+    axes.legend()
+    figure.savefig(os.path.join(out, "rate.png"), dpi=120)
+    plt.close("all")
+
+
+def analyze(path: str, targets: list[str] = (), gap_factor: float = GAP_FACTOR, out: str = None,
+            plots: bool = True) -> dict:
+    "Analyze the recorded samples, write the report and plots to the out folder, and return the report."
+    samples = load_samples(path)
+    add_intervals(samples)
+    sensors = list(samples["sensor"].cat.categories)
+    gaps = find_gaps(samples, gap_factor)
+    stats = sensor_stats(samples, parse_targets(targets, sensors), gaps)
+    skew = timing_skew(samples)
+    text = format_report(stats, gaps, skew)
+    print(text)
+    if out is None:
+        out = os.path.splitext(path)[0] + "_analysis"
+    os.makedirs(out, exist_ok=True)
+    report = {
+        "file": path,
+        "sensors": json.loads(stats.to_json(orient="index")),
+        "gaps": json.loads(gaps.head(MAX_GAPS_LISTED).to_json(orient="records")),
+        "skew": json.loads(skew.to_json(orient="records")),
+    }
+    with open(os.path.join(out, "report.txt"), "w") as f:
+        f.write(text)
+    with open(os.path.join(out, "report.json"), "w") as f:
+        json.dump(report, f, indent=2)
+    if plots:
+        plot(samples, out)
+    print(f"Report and plots written to {out}")
+    return report
+
+
+if __name__ == "__main__":
+    "Main entry point."
+    parser = ArgumentParser(description="Analyze the sampling rate, jitter, gaps, and skew of a recorded run.")
+    parser.add_argument("file", help="CSV file recorded with telemetry_viewer.py -record")
+    parser.add_argument("-target", nargs="*", default=[],
+                        help="target rate in Hz, for every sensor (eg 100) or by sensor name (eg Ultrasonic=20)")
+    parser.add_argument("-gap", type=float, default=GAP_FACTOR, help="median intervals after which a gap starts")
+    parser.add_argument("-out", help="folder for the report and plots, FILE_analysis by default")
+    parser.add_argument("-noplots", action="store_true", help="only write the report")
+    args = parser.parse_args()
+
+    analyze(args.file, args.target, args.gap, args.out, not args.noplots)
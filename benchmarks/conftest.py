@@ -0,0 +1,137 @@
+"""
+Benchmark suite configuration. The benchmarks run against the simulated brick from
+utils.simulation, so they can run on any computer.
+
+Each benchmark records its results with the `bench` fixture. At the end of the run, all results
+are written to benchmarks/results.json and compared to a baseline, and results that are worse
+than the baseline by more than the threshold are reported as regressions.
+
+pipenv run python3 -m pytest benchmarks                         # run and compare to the baseline
+pipenv run python3 -m pytest benchmarks --bench-save-baseline   # make these results the baseline
+pipenv run python3 -m pytest benchmarks --bench-fail-on-regression
+"""
+
+from __future__ import annotations  # not required in Python 3.10+
+from datetime import datetime
+import json
+import os
+import platform
+import signal
+import sys
+
+import pytest
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, "..", "project"))
+
+from utils import simulation  # noqa: E402
+
+simulation.install()
+
+from utils import brick  # noqa: E402
+
+# utils.brick runs its own shutdown on Ctrl-C and exits, restore the default so pytest stops normally
+signal.signal(signal.SIGINT, signal.default_int_handler)
+
+RESULTS_FILE = os.path.join(BENCHMARKS_DIR, "results.json")
+BASELINE_FILE = os.path.join(BENCHMARKS_DIR, "baseline.json")
+DEFAULT_THRESHOLD = 0.25  # fraction by which a result may be worse than the baseline
+
+
+class Bench:
+    "Collects the results of the benchmarks."
+
+    def __init__(self):
+        self.results: dict[str, dict] = {}
+        self.test_name = ""
+
+    def record(self, metric: str, value: float, unit: str, higher_is_better: bool):
+        "Record a result of the running benchmark."
+        self.results[f"{self.test_name}.{metric}"] = {
+            "value": value, "unit": unit, "higher_is_better": higher_is_better}
+
+
+_bench = Bench()
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("benchmarks")
+    group.addoption("--bench-baseline", default=BASELINE_FILE, help="baseline results file to compare to")
+    group.addoption("--bench-save-baseline", action="store_true", help="save the results as the new baseline")
+    group.addoption("--bench-threshold", type=float, default=DEFAULT_THRESHOLD,
+                    help="fraction by which a result may be worse than the baseline")
+    group.addoption("--bench-fail-on-regression", action="store_true", help="fail the run if there are regressions")
+
+
+@pytest.fixture
+def bench(request) -> Bench:
+    "Return the result collector, set up for the running benchmark."
+    _bench.test_name = request.node.name
+    return _bench
+
+
+@pytest.fixture
+def sim() -> brick.BrickPi3:
+    "Return the simulated brick, reset after the benchmark."
+    yield brick.BP
+    brick.BP.sim_reset()
+
+
+def compare(results: dict[str, dict], baseline: dict[str, dict], threshold: float) -> list[str]:
+    "Return a description of every result that is worse than its baseline by more than the threshold."
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline or not baseline[key]["value"]:
+            continue
+        old, new = baseline[key]["value"], result["value"]
+        change = (new - old) / abs(old)
+        worse = -change if result["higher_is_better"] else change
+        if worse > threshold:
+            regressions.append(f"{key}: {old:.4g} -> {new:.4g} {result['unit']} ({worse:+.0%} worse)")
+    return regressions
+
+
+def pytest_sessionfinish(session, exitstatus):
+    "Write the results and compare them to the baseline."
+    if not _bench.results:
+        return
+    config = session.config
+    report = {
+        "environment": {
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "node": platform.node(),
+            "backend": "simulated",
+            "transfer_time": brick.BP.transfer_time,
+        },
+        "results": _bench.results,
+    }
+    with open(RESULTS_FILE, "w") as f:
+        json.dump(report, f, indent=2)
+    if config.getoption("--bench-save-baseline"):
+        with open(config.getoption("--bench-baseline"), "w") as f:
+            json.dump(report, f, indent=2)
+    regressions = []
+    if os.path.exists(config.getoption("--bench-baseline")):
+        with open(config.getoption("--bench-baseline")) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(_bench.results, baseline, config.getoption("--bench-threshold"))
+    config._bench_regressions = regressions
+    if regressions and config.getoption("--bench-fail-on-regression"):
+        session.exitstatus = pytest.ExitCode.TESTS_FAILED
+
+
+def pytest_terminal_summary(terminalreporter, exitstatus, config):
+    "Show the results and the regressions."
+    if not _bench.results:
+        return
+    terminalreporter.section("benchmark results")
+    for key, result in _bench.results.items():
+        terminalreporter.write_line(f"{key:<64} {result['value']:>12.4g} {result['unit']}")
+    terminalreporter.write_line(f"Results written to {os.path.relpath(RESULTS_FILE)}")
+    regressions = getattr(config, "_bench_regressions", [])
+    if regressions:
+        terminalreporter.section("benchmark regressions", red=True)
+        for regression in regressions:
+            terminalreporter.write_line(regression, red=True)
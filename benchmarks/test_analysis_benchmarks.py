@@ -0,0 +1,47 @@
+"""
+Benchmarks of the offline analysis of recorded runs, analyze_samples.py.
+"""
+
+from __future__ import annotations  # not required in Python 3.10+
+from time import perf_counter
+import os
+import sys
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pd = pytest.importorskip("pandas")
+pytest.importorskip("matplotlib")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from analyze_samples import analyze  # noqa: E402
+
+SAMPLES = 1_000_000
+
+
+@pytest.fixture(scope="module")
+def recording(tmp_path_factory) -> str:
+    "Return a recorded run of two sensors at 100 and 200 Hz with one 0.5 s gap each, a million samples in total."
+    rng = np.random.default_rng(0)
+    frames = []
+    for sensor, rate, count in (("EV3UltrasonicSensor", 100, SAMPLES * 2 // 5), ("EV3ColorSensor", 200, SAMPLES * 3 // 5)):
+        times = 1.7e9 + np.cumsum(rng.normal(1 / rate, 0.1 / rate, count).clip(1e-5))
+        times[count // 2:] += 0.5
+        frames.append(pd.DataFrame({"time": times, "received": times + 0.003 + rng.exponential(0.001, count),
+                                    "sensor": sensor, "index": 0, "value": rng.random(count)}))
+    path = str(tmp_path_factory.mktemp("analysis") / "run.csv")
+    pd.concat(frames).sort_values("time").to_csv(path, index=False)
+    return path
+
+
+def test_analyze_million_samples(bench, recording, tmp_path):
+    start = perf_counter()
+    report = analyze(recording, ["Ultrasonic=100", "Color=200"], out=str(tmp_path))
+    elapsed = perf_counter() - start
+    sensors = report["sensors"]
+    assert sensors["EV3UltrasonicSensor"]["samples"] + sensors["EV3ColorSensor"]["samples"] == SAMPLES
+    assert all(stats["gaps"] == 1 and 0.99 < stats["rate_ratio"] < 1.01 for stats in sensors.values())
+    assert os.path.exists(tmp_path / "rate.png") and os.path.exists(tmp_path / "report.json")
+    bench.record("analysis_time", elapsed, "s", higher_is_better=False)
+    bench.record("samples_per_s", SAMPLES / elapsed, "Hz", higher_is_better=True)
@@ -0,0 +1,246 @@
+"""
+Benchmarks of sampling throughput, latency, and thread scaling of utils.brick, on the simulated brick.
+"""
+
+from __future__ import annotations  # not required in Python 3.10+
+from statistics import median, quantiles
+from threading import Event, Thread
+from queue import Queue
+from time import monotonic, perf_counter, process_time, sleep, thread_time
+
+import pytest
+
+from utils import metrics
+from utils.acquisition import AcquisitionProcess
+from utils.brick import (CircuitBreaker, EV3ColorSensor, EV3UltrasonicSensor, Sensor, SensorReading, TouchSensor,
+                         configure_ports, stop_motors)
+from utils.shutdown import MOTOR, ShutdownCoordinator
+from utils.touch_events import TouchEvent, TouchPoller
+from utils.watchdog import Watchdog
+
+DURATION = 0.5  # seconds per measurement
+
+
+def read_for(sensor: Sensor, duration: float, stop: Event = None) -> int:
+    "Read the sensor as fast as possible for the given time, and return the number of reads."
+    reads = 0
+    end = perf_counter() + duration
+    while perf_counter() < end and not (stop and stop.is_set()):
+        sensor.get_value()
+        reads += 1
+    return reads
+
+
+def test_configure_ports_startup(bench):
+    start = perf_counter()
+    devices = configure_ports(PORT_1=EV3UltrasonicSensor, PORT_2=EV3ColorSensor, PORT_3=TouchSensor,
+                              print_status=False)
+    elapsed = perf_counter() - start
+    assert len(devices) == 3
+    bench.record("startup_time", elapsed * 1e3, "ms", higher_is_better=False)
+
+
+@pytest.fixture(scope="module")
+def sensors() -> list[Sensor]:
+    "Return sensors configured on all four ports."
+    return configure_ports(PORT_1=EV3UltrasonicSensor, PORT_2=EV3ColorSensor, PORT_3=EV3UltrasonicSensor,
+                           PORT_4=EV3ColorSensor, print_status=False)
+
+
+def test_single_sensor_read_throughput(bench, sensors):
+    sensor = sensors[0]
+    latencies = []
+    end = perf_counter() + DURATION
+    while perf_counter() < end:
+        start = perf_counter()
+        sensor.get_value()
+        latencies.append(perf_counter() - start)
+    assert all(latency > 0 for latency in latencies)
+    bench.record("reads_per_s", len(latencies) / DURATION, "Hz", higher_is_better=True)
+    bench.record("latency_p50", median(latencies) * 1e6, "us", higher_is_better=False)
+    bench.record("latency_p99", quantiles(latencies, n=100)[98] * 1e6, "us", higher_is_better=False)
+
+
+@pytest.mark.parametrize("num_threads", [1, 2, 4, 8])
+def test_multi_sensor_throughput(bench, sensors, num_threads):
+    counts = [0] * num_threads
+
+    def sample(n: int, sensor: Sensor):
+        counts[n] = read_for(sensor, DURATION)
+
+    threads = [Thread(target=sample, args=(n, sensors[n % len(sensors)])) for n in range(num_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(counts)
+    bench.record("reads_per_s", sum(counts) / DURATION, "Hz", higher_is_better=True)
+    bench.record("min_thread_reads_per_s", min(counts) / DURATION, "Hz", higher_is_better=True)
+
+
+def test_wait_ready_cpu_cost(bench, sensors, sim):
+    sensor = sensors[0]
+    waits, cpu, wall = 10, 0.0, 0.0
+    for n in range(waits):
+        sensor.set_mode(EV3UltrasonicSensor.Mode.IN if n % 2 else EV3UltrasonicSensor.Mode.CM)
+        cpu_start, wall_start = thread_time(), perf_counter()
+        sensor.wait_ready()
+        cpu += thread_time() - cpu_start
+        wall += perf_counter() - wall_start
+    assert sensor.get_status() == Sensor.Status.VALID_DATA
+    sensor.set_mode(EV3UltrasonicSensor.Mode.CM)
+    sensor.wait_ready()
+    bench.record("cpu_per_wait", cpu / waits * 1e3, "ms", higher_is_better=False)
+    bench.record("cpu_fraction", cpu / wall, "", higher_is_better=False)
+
+
+@pytest.mark.parametrize("background_samplers", [0, 2])
+def test_scheduler_jitter(bench, sensors, background_samplers):
+    period, lateness = 0.005, []
+    stop = Event()
+    samplers = [Thread(target=read_for, args=(sensors[n], DURATION * 2, stop)) for n in range(background_samplers)]
+    for sampler in samplers:
+        sampler.start()
+    deadline = perf_counter()
+    end = deadline + DURATION
+    while deadline < end:
+        deadline += period
+        sleep(max(0, deadline - perf_counter()))
+        lateness.append(perf_counter() - deadline)
+    stop.set()
+    for sampler in samplers:
+        sampler.join()
+    bench.record("lateness_p50", median(lateness) * 1e6, "us", higher_is_better=False)
+    bench.record("lateness_p99", quantiles(lateness, n=100)[98] * 1e6, "us", higher_is_better=False)
+    bench.record("lateness_max", max(lateness) * 1e6, "us", higher_is_better=False)
+
+
+@pytest.mark.parametrize("fault_rate", [0.3, 1.0])
+def test_flaky_port_reads(bench, sensors, sim, fault_rate):
+    sensor = sensors[0]
+    sim.sim_set_fault_rate(sim.PORT_1, fault_rate)
+    for method in ("get_value", "read"):
+        valid = iterations = 0
+        transfers = sim.transfers
+        end = perf_counter() + DURATION / 2
+        while perf_counter() < end:
+            if method == "read":
+                status, value = sensor.read()
+                valid += status == Sensor.Status.VALID_DATA
+            else:
+                valid += sensor.get_value() is not None
+            iterations += 1
+        bench.record(f"{method}_loops_per_s", iterations / DURATION * 2, "Hz", higher_is_better=True)
+        bench.record(f"{method}_valid_per_s", valid / DURATION * 2, "Hz", higher_is_better=True)
+        bench.record(f"{method}_transfers_per_s", (sim.transfers - transfers) / DURATION * 2, "Hz",
+                     higher_is_better=False)
+    sensor.breaker = CircuitBreaker()
+
+
+@pytest.fixture
+def touch_sensor(sensors) -> TouchSensor:
+    "Return a touch sensor on port 3, then set the port back to the ultrasonic sensor of the sensors fixture."
+    touch_sensor = TouchSensor(3)
+    touch_sensor.wait_ready()
+    yield touch_sensor
+    sensors[2].set_mode(sensors[2].mode)
+    sensors[2].wait_ready()
+
+
+def test_touch_press_to_reaction_latency(bench, sim, touch_sensor):
+    poller = TouchPoller(rate=200, debounce=0.01)
+    events = Queue()
+    poller.add(touch_sensor, queue=events)
+    try:
+        latencies = []
+        for n in range(20):
+            pressed = n % 2 == 0
+            start = monotonic()
+            sim.sim_set_value(sim.PORT_3, int(pressed))
+            event = events.get(timeout=1)
+            latencies.append(monotonic() - start)
+            assert event.kind == (TouchEvent.PRESS if pressed else TouchEvent.RELEASE)
+        cpu_start, idle_start = process_time(), perf_counter()
+        sleep(DURATION)
+        idle_cpu = (process_time() - cpu_start) / (perf_counter() - idle_start)
+    finally:
+        poller.stop()
+    bench.record("latency_p50", median(latencies) * 1e3, "ms", higher_is_better=False)
+    bench.record("latency_max", max(latencies) * 1e3, "ms", higher_is_better=False)
+    bench.record("idle_cpu_fraction", idle_cpu, "", higher_is_better=False)
+
+
+def test_threadexample_sampling_loop(bench):
+    import threadexample  # configures ports 1 and 2 like the sensors fixture
+    channel = threadexample.TELEMETRY.add_channel("benchmark")
+    reads = 0
+    end = perf_counter() + DURATION
+    while perf_counter() < end:
+        threadexample.TELEMETRY.record(channel, threadexample.US_SENSOR.get_value())
+        reads += 1
+    bench.record("reads_per_s", reads / DURATION, "Hz", higher_is_better=True)
+
+
+def test_shared_memory_acquisition(bench):
+    acquisition = AcquisitionProcess(PORT_1=EV3UltrasonicSensor, PORT_2=EV3ColorSensor, period=0.002)
+    us_sensor, color_sensor = acquisition.start()
+    try:
+        reads, ages = 0, []
+        end = perf_counter() + DURATION
+        while perf_counter() < end:
+            us_sensor.get_value()
+            reads += 1
+            if reads % 100 == 0:
+                ages.append(color_sensor.get_age())
+        assert us_sensor.get_status() == Sensor.Status.VALID_DATA
+    finally:
+        acquisition.stop()
+    bench.record("reads_per_s", reads / DURATION, "Hz", higher_is_better=True)
+    bench.record("sample_age_p50", median(ages) * 1e3, "ms", higher_is_better=False)
+
+
+def test_metrics_overhead(bench):
+    results = metrics.benchmark()
+    assert not metrics.is_enabled()
+    bench.record("disabled_call", results["disabled_ns"], "ns", higher_is_better=False)
+    bench.record("enabled_overhead", results["overhead_ns"], "ns", higher_is_better=False)
+
+
+def test_shutdown_time(bench, sim):
+    coordinator = ShutdownCoordinator(deadline=1)
+    coordinator.register("motors", stop_motors, kind=MOTOR)
+    sim.set_motor_power(sim.PORT_A | sim.PORT_B, 50)
+    for n in range(4):
+        thread = Thread(target=lambda: coordinator.stopping.wait(), name=f"worker-{n}")
+        coordinator.register_thread(thread)
+        thread.start()
+    report = coordinator.shutdown("benchmark")
+    assert not report.overran
+    assert sim.get_motor_status(sim.PORT_A)[1] == 0
+    bench.record("shutdown_time", report.total * 1e3, "ms", higher_is_better=False)
+
+
+def test_watchdog_stall_detection(bench, sensors):
+    watchdog = Watchdog(interval=0.005)
+    alerts = Queue()
+    watchdog.add_alert(lambda name, age: alerts.put(monotonic()))
+    reading = SensorReading()
+    try:
+        with watchdog.register("sampler", period=0.01, tolerance=2) as heartbeat:
+            end = perf_counter() + DURATION / 2
+            while perf_counter() < end:
+                heartbeat.beat()
+                sensors[0].read(reading)
+            beat_time = perf_counter()
+            for _ in range(10000):
+                heartbeat.beat()
+            beat_time = (perf_counter() - beat_time) / 10000
+            assert alerts.empty() and reading.fresh(0.02)[0] == Sensor.Status.VALID_DATA
+            stall_start = monotonic()  # the sampler stops beating, as if stuck
+            detected = alerts.get(timeout=1)
+            assert heartbeat.stalled and watchdog.misses["sampler"] == 1
+            assert reading.fresh(0.02) == (Sensor.Status.STALE, None)
+    finally:
+        watchdog.stop()
+    bench.record("beat_cost", beat_time * 1e9, "ns", higher_is_better=False)
+    bench.record("detection_after_deadline", (detected - stall_start - 0.02) * 1e3, "ms", higher_is_better=False)
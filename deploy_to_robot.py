@@ -5,19 +5,98 @@ Script to deploy this project from a computer to a robot. See main entry point a
 command line arguments.
 """
 
-from threading import Thread
-from tkinter import Tk
-from tkinter.ttk import Button
+from __future__ import annotations  # not required in Python 3.10+
+from queue import Empty, Queue
+from subprocess import DEVNULL, PIPE, STDOUT, Popen
+from threading import Event, Lock, Thread
+from time import time
+from tkinter import END, Tk
+from tkinter.scrolledtext import ScrolledText
+from tkinter.ttk import Button, Frame, Label, Progressbar
 from types import FunctionType
+from typing import Callable
 import json
 import os
+import re
+import signal
+import subprocess
 import sys
 
+from project.utils.control import SECRET_VARIABLE, stop_program
+
 
 ENV_FILE = ".env"  # in this folder
 ECSE211_DIR = "/home/pi/ecse211"  # on the brick
 
-error = lambda text: print(f"\033[91m{text}\033[0m")  # print text in red
+
+class ActionCancelled(Exception):
+    "Raised inside an action when the user cancels it."
+
+
+class CommandRunner:
+    """
+    Run shell commands one at a time, forwarding their output line by line to a callback.
+    The command that is currently running can be cancelled from another thread.
+    """
+
+    def __init__(self, output: Callable[[str], None] = print):
+        self.output = output
+        self.cancelled = Event()
+        self._process: Popen | None = None
+        self._on_cancel: Callable[[], None] | None = None
+        self._lock = Lock()
+
+    def run(self, command: str, on_cancel: Callable[[], None] = None) -> int:
+        """
+        Run the command and return its exit status. Raise ActionCancelled if it was cancelled.
+        If it is cancelled while running, on_cancel() is then called on another thread, eg to stop
+        what the command started on the robot, which killing the command does not stop.
+        """
+        # Start each command in its own process group so it can be stopped with all of its children
+        group = {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP} if is_windows else {"start_new_session": True}
+        with self._lock:
+            if self.cancelled.is_set():
+                raise ActionCancelled
+            self._process = process = Popen(command, shell=True, stdin=DEVNULL, stdout=PIPE, stderr=STDOUT,
+                                            text=True, errors="replace", bufsize=1, **group)
+            self._on_cancel = on_cancel
+        try:
+            for line in process.stdout:
+                self.output(line.rstrip("\n"))
+            status = process.wait()
+        except BaseException:  # eg Ctrl-C, which does not reach the command in its own session
+            self.cancel()
+            raise
+        finally:
+            with self._lock:
+                self._process = self._on_cancel = None
+        if self.cancelled.is_set():
+            raise ActionCancelled
+        return status
+
+    def cancel(self):
+        "Stop the running command, if any, and make subsequent commands of the same action fail fast."
+        with self._lock:
+            self.cancelled.set()
+            if self._process is None or self._process.poll() is not None:
+                return
+            if is_windows:
+                subprocess.run(f"taskkill /F /T /PID {self._process.pid}", stdout=DEVNULL, stderr=DEVNULL)
+            else:
+                os.killpg(self._process.pid, signal.SIGTERM)
+            if self._on_cancel is not None:  # not a daemon thread, so it finishes even if this script exits
+                Thread(target=self._on_cancel, name="on_cancel").start()
+
+
+runner = CommandRunner()  # runs all shell commands of this script
+
+
+def log(text: str):
+    "Show text in the output of the command runner, which is the terminal unless the GUI is open."
+    runner.output(text)
+
+
+error = lambda text: log(f"\033[91m{text}\033[0m")  # print text in red
 
 
 def is_raspberry_pi() -> bool:
@@ -51,12 +130,13 @@ is_windows = os.name == "nt"
 project_info = read_project_info()
 robot_name = f"dpm-{project_info['group']}.local"
 password = read_password()
+control_secret = password.encode().hex()  # secret of the control port, the password without any shell quoting
 
 
-def copy_project_folder_to_brick():
+def copy_project_folder_to_brick() -> bool:
     """
     Copy this project folder to brick, under the ecse211 folder. This will overwrite previous
-    versions of the project.
+    versions of the project. Return True if the copy succeeded.
     """
     project_name = os.path.basename(os.getcwd())
     robot_project_path = f"{ECSE211_DIR}/{project_name}"
@@ -66,82 +146,238 @@ def copy_project_folder_to_brick():
         if command_result(rm_cmd):
             error("Failed to connect to brick or remove old project. Please ensure the brick is turned on and "
                   "connected to the same network as this computer.")
-        else:
-            copy_cmd = f'pscp -batch -l pi -pw "{password}" -r {os.getcwd()} pi@{robot_name}:{ECSE211_DIR}'
+            return False
+        copy_cmd = f'pscp -batch -l pi -pw "{password}" -r {os.getcwd()} pi@{robot_name}:{ECSE211_DIR}'
     else:
         copy_cmd = f'''sshpass -p "{password}" ssh pi@{robot_name} "rm -rf {robot_project_path
             }" && sshpass -p "{password}" scp -pr "{os.getcwd()}" pi@{robot_name}:{robot_project_path}'''
-    print(f"Copying {project_name} to {robot_name}...")
+    log(f"Copying {project_name} to {robot_name}...")
     if command_result(copy_cmd):
         error("Failed to copy project to brick. Please ensure it is turned on and connected to "
               "the same network as this computer.")
+        return False
+    return True
 
 
 def run_on_brick(program_path: str, cmd: str):
-    "Run a given command on the brick, using the given path as a working directory."
+    """
+    Run a given command on the brick, using the given path as a working directory. If it is cancelled,
+    the program it started on the brick is stopped too, since it keeps running, with its motors on,
+    when the SSH session is killed.
+    """
     if is_windows:
         run_cmd = f'plink -batch -l pi -pw "{password}" {robot_name} "cd {program_path} && {cmd}"'
     else:
         run_cmd = f'sshpass -p "{password}" ssh pi@{robot_name} "cd {program_path} && {cmd}"'
-    print(f"Running command on {robot_name}:\n> {run_cmd}".replace(password, 8 * '*'))
-    if command_result(run_cmd):
-        error(f"Failed to run `{run_cmd}` command on brick.")
+    shown_cmd = run_cmd.replace(password, 8 * '*').replace(control_secret, 8 * '*')
+    log(f"Running command on {robot_name}:\n> {shown_cmd}")
+    if command_result(run_cmd, on_cancel=stop_program_on_brick):
+        error(f"Failed to run `{shown_cmd}` command on brick.")
+
+
+def stop_program_on_brick():
+    "Stop the program running on the brick through its control socket, after its SSH session was killed."
+    if stop_program(robot_name, control_secret):
+        log(f"Stopped the program running on {robot_name}.")
+    else:
+        error(f"No program answered on {robot_name}, or it did not stop in time. Please reset the robot.")
 
 
-def command_result(command: str) -> int:
+def command_result(command: str, on_cancel: Callable[[], None] = None) -> int:
     "Return an integer status code, 0 if successful, non-zero otherwise."
-    if is_windows:  # Windows
-        return os.system(command)
-    else:  # *nix
-        return os.WEXITSTATUS(os.system(command))
+    return runner.run(command, on_cancel)
 
 
 def run_main_entry_point():
     "Run the main entry point defined in project_info.json."
     project_name = os.path.basename(os.getcwd())
     main_entry_point = project_info["entrypoint"]
-    python_cmd = f"python3 {main_entry_point}"
+    # Unbuffered, so output is shown as soon as it is printed, and with the secret of the control port,
+    # so only this script can stop the program over the network
+    python_cmd = f"{SECRET_VARIABLE}={control_secret} python3 -u {main_entry_point}"
     run_on_brick(f"{ECSE211_DIR}/{project_name}", python_cmd)
 
 
 def deploy_and_run():
-    "Copy project to robot then run main entry point."
-    copy_project_folder_to_brick()
-    run_main_entry_point()
+    "Copy project to robot then run main entry point if the copy succeeded."
+    if copy_project_folder_to_brick():
+        run_main_entry_point()
 
 
 def reset_brick():
-    "Reset the brick."
+    """
+    Reset the brick. Ask the running program to stop through its control socket first, which takes
+    milliseconds, and fall back to running the reset script over SSH if no program answers or if it
+    does not exit in time.
+    """
+    if stop_program(robot_name, control_secret):
+        log(f"Stopped the program running on {robot_name}.")
+        return
     project_name = os.path.basename(os.getcwd())
     run_on_brick(f"{ECSE211_DIR}/{project_name}", "python3 scripts/reset_brick.py")
 
 
-def run_in_background(action: FunctionType) -> FunctionType:
-    "Use to run an action (a function) in the background."
-    return Thread(target=action).start
+class TaskQueue:
+    """
+    Run actions one at a time on a single background thread, so that two actions never operate on
+    the robot at the same time. An action that is already queued or running is not queued again.
+
+    Progress is reported by calling notify(event, action, detail) from the background thread,
+    where event is one of "queued", "started", "finished", "failed", or "cancelled".
+    """
+
+    def __init__(self, runner: CommandRunner, notify: Callable[[str, FunctionType, str], None]):
+        self.runner = runner
+        self.notify = notify
+        self.current: FunctionType | None = None
+        self._queue: Queue[FunctionType] = Queue()
+        self._pending: list[FunctionType] = []  # queued and running actions, in order
+        self._lock = Lock()
+        Thread(target=self._work, daemon=True).start()
+
+    def submit(self, action: FunctionType) -> bool:
+        "Queue the action unless it is already queued or running. Return True if it was queued."
+        with self._lock:
+            if action in self._pending:
+                return False
+            self._pending.append(action)
+            self._queue.put(action)
+        self.notify("queued", action, "")
+        return True
+
+    def cancel(self):
+        "Cancel the running action and drop all queued actions."
+        with self._lock:
+            for dropped in [action for action in self._pending if action is not self.current]:
+                self._pending.remove(dropped)  # the worker skips dequeued actions that are no longer pending
+                self.notify("cancelled", dropped, "not started")
+            self.runner.cancel()
+
+    def pending_count(self) -> int:
+        "Return the number of queued and running actions."
+        with self._lock:
+            return len(self._pending)
+
+    def _work(self):
+        "Run queued actions forever. Called on the background thread."
+        while True:
+            action = self._queue.get()
+            with self._lock:
+                if action not in self._pending:  # dropped by cancel()
+                    continue
+                self.runner.cancelled.clear()
+                self.current = action
+            self.notify("started", action, "")
+            start = time()
+            try:
+                action()
+                event, detail = "finished", ""
+            except ActionCancelled:
+                event, detail = "cancelled", ""
+            except Exception as e:  # keep the worker alive for the next action
+                event, detail = "failed", f"{e.__class__.__name__}: {e}"
+            with self._lock:
+                self.current = None
+                self._pending.remove(action)
+            self.notify(event, action, f"{time() - start:.1f} s{', ' if detail else ''}{detail}")
 
 
 class DeployToRobotGUI:
-    "Simple window with robot deployment options."
-    DELAY_MS = 100  # delay between button updates in milliseconds
+    """
+    Simple window with robot deployment options. Actions run one at a time in the background
+    and their output is shown in the window. The window is only updated when an action produces
+    output or changes state, it does not poll.
+    """
     PAD_X, PAD_Y = 20, 5  # padding between window buttons in pixels
+    LOG_LINES = 1000  # maximum number of lines kept in the log
+    UPDATE_EVENT = "<<TaskUpdate>>"
+    ANSI_RED, ANSI_ESCAPE = "\033[91m", re.compile(r"\033\[[0-9;]*m")
 
     def __init__(self, root: Tk):
         self.root = root
         root.title("Deploy to robot options")
-        self.button_actions: dict[Button, FunctionType] = {
-            Button(root, text="Deploy DPM Project on Robot without running"): copy_project_folder_to_brick,
-            Button(root, text="Deploy and run DPM Project on Robot"): deploy_and_run,
-            Button(root, text="Reset Robot"): reset_brick,
+        self.action_names: dict[FunctionType, str] = {
+            copy_project_folder_to_brick: "Deploy DPM Project on Robot without running",
+            deploy_and_run: "Deploy and run DPM Project on Robot",
+            reset_brick: "Reset Robot",
         }
-        for button in self.button_actions:
-            button.pack(padx=self.PAD_X, pady=self.PAD_Y)
-
-    def update_button_actions(self):
-        "Recursively update button actions to allow them to be spawned repeatedly."
-        for button, action in self.button_actions.items():
-            button.config(command=run_in_background(action))
-        self.root.after(self.DELAY_MS, self.update_button_actions)
+        self.buttons: dict[FunctionType, Button] = {}
+        for action, name in self.action_names.items():
+            self.buttons[action] = button = Button(root, text=name, command=lambda action=action: self.submit(action))
+            button.pack(padx=self.PAD_X, pady=self.PAD_Y, fill="x")
+        controls = Frame(root)
+        controls.pack(padx=self.PAD_X, pady=self.PAD_Y, fill="x")
+        self.cancel_button = Button(controls, text="Cancel", command=self.cancel, state="disabled")
+        self.cancel_button.pack(side="right")
+        self.progress = Progressbar(controls, mode="indeterminate")
+        self.progress.pack(side="left", fill="x", expand=True, padx=(0, self.PAD_X))
+        self.status = Label(root, text="Idle")
+        self.status.pack(padx=self.PAD_X, anchor="w")
+        self.log = ScrolledText(root, height=15, width=100, state="disabled")
+        self.log.tag_configure("error", foreground="red")
+        self.log.pack(padx=self.PAD_X, pady=self.PAD_Y, fill="both", expand=True)
+
+        # Messages from background threads are put on this queue, then the main thread is woken up
+        # by a virtual event to show them, since Tk widgets must only be changed on the main thread
+        self.messages: Queue[Callable[[], None]] = Queue()
+        root.bind(self.UPDATE_EVENT, self.show_messages)
+        runner.output = lambda line: self.post(lambda: self.append_log(line))
+        self.tasks = TaskQueue(runner, lambda *args: self.post(lambda: self.on_task_event(*args)))
+
+    def post(self, message: Callable[[], None]):
+        "Schedule a GUI update from any thread."
+        self.messages.put(message)
+        self.root.event_generate(self.UPDATE_EVENT, when="tail")
+
+    def show_messages(self, _event=None):
+        "Apply all pending GUI updates. Called on the main thread."
+        while True:
+            try:
+                self.messages.get_nowait()()
+            except Empty:
+                return
+
+    def submit(self, action: FunctionType):
+        "Queue the action for the button that was clicked."
+        if not self.tasks.submit(action):
+            self.append_log(f"{self.action_names[action]} is already queued or running, ignoring click.")
+
+    def cancel(self):
+        "Cancel the running action and drop the queued ones."
+        self.append_log("Cancelling...")
+        self.tasks.cancel()
+
+    def on_task_event(self, event: str, action: FunctionType, detail: str):
+        "Show the state change of an action in the log, the status line, and the buttons."
+        name = self.action_names[action]
+        if event == "started":
+            self.append_log(f"=== {name} ===")
+        elif event != "queued":
+            self.append_log(f"{'' if event == 'finished' else self.ANSI_RED}{name} {event} ({detail})")
+            if event == "finished":
+                self.buttons[action].config(text=f"{name} (last: {detail})")
+        busy = self.tasks.pending_count()
+        if busy:
+            current = self.tasks.current
+            running = f"Running: {self.action_names[current]}" if current else "Starting"
+            self.status.config(text=f"{running}, {busy - 1} queued" if busy > 1 else running)
+            self.progress.start()
+            self.cancel_button.config(state="normal")
+        else:
+            self.status.config(text="Idle")
+            self.progress.stop()
+            self.cancel_button.config(state="disabled")
+
+    def append_log(self, line: str):
+        "Add a line to the log, in red if it is an error, and scroll to it."
+        tags = ("error",) if self.ANSI_RED in line else ()
+        self.log.config(state="normal")
+        self.log.insert(END, self.ANSI_ESCAPE.sub("", line) + "\n", tags)
+        excess = int(self.log.index("end-1c").split(".")[0]) - self.LOG_LINES
+        if excess > 0:
+            self.log.delete("1.0", f"{excess + 1}.0")
+        self.log.see(END)
+        self.log.config(state="disabled")
 
 
 if __name__ == "__main__":
@@ -152,14 +388,17 @@ if __name__ == "__main__":
 
     if len(sys.argv) == 1:  # show GUI when there are no commmand line arguments
         root = Tk()
-        DeployToRobotGUI(root).update_button_actions()
+        DeployToRobotGUI(root)
         root.mainloop()
 
     if "-copy" in sys.argv:
         copy_project_folder_to_brick()
 
     if "-run" in sys.argv:
-        run_main_entry_point()
+        try:
+            run_main_entry_point()
+        except KeyboardInterrupt:  # the runner killed SSH, and stops the program on the robot before exiting
+            error("Cancelled.")
 
     if "-reset" in sys.argv:
         reset_brick()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+"""
+Experiment that answers "how many threads can we run at once on the BrickPi, and what happens
+with too many?". It runs 1, 2, ..., N sampler threads over the configured sensors, measures
+what each thread achieves, and reports the knee of the scaling curve: the number of threads
+after which adding another one no longer increases the total sampling rate.
+
+For every thread count, it reports:
+- the aggregate and per-thread achieved sampling rates
+- the wait to resume after each sleep, which is mostly time spent waiting for the GIL
+  (the Global Interpreter Lock, which only lets one thread run Python code at a time)
+- voluntary and involuntary context switches per second, from /proc
+- the extra resident memory per thread, from /proc
+
+Usage: python3 project/thread_scaling.py [-threads N] [-duration SECONDS] [-period SECONDS]
+                                         [-json FILE] [-sim]
+"""
+
+from __future__ import annotations  # not required in Python 3.10+
+from argparse import ArgumentParser
+from statistics import mean, quantiles
+from threading import Barrier, Thread, get_native_id
+from time import perf_counter, process_time, sleep
+import json
+
+
+KNEE_GAIN = 0.05  # adding a thread must increase the total rate by this fraction to be worth it
+
+
+def read_proc_status(path: str) -> dict[str, str]:
+    "Return the fields of a /proc status file, or an empty dictionary if it does not exist (not Linux)."
+    try:
+        with open(path) as f:
+            return dict(line.split(":", 1) for line in f if ":" in line)
+    except OSError:
+        return {}
+
+
+def context_switches() -> tuple[int, int]:
+    "Return the (voluntary, involuntary) context switches of the calling thread so far."
+    status = read_proc_status(f"/proc/self/task/{get_native_id()}/status")
+    return (int(status.get("voluntary_ctxt_switches", 0)), int(status.get("nonvoluntary_ctxt_switches", 0)))
+
+
+def resident_memory_kb() -> int:
+    "Return the resident memory of this process in kB."
+    return int(read_proc_status("/proc/self/status").get("VmRSS", "0 kB").split()[0])
+
+
+class SamplerResult:
+    "What one sampler thread achieved."
+
+    def __init__(self):
+        self.reads = 0
+        self.wakeup_waits: list[float] = []  # seconds beyond the requested sleep time
+        self.voluntary_switches = self.involuntary_switches = 0
+
+
+def sampler(sensor, duration: float, period: float, start: Barrier, result: SamplerResult):
+    """
+    Read the sensor every period seconds (as fast as possible if 0) for the given duration.
+    Each sampler gets its own sensor argument, rather than capturing a loop variable in a lambda,
+    so every thread reads the sensor it was given.
+    """
+    start.wait()
+    voluntary, involuntary = context_switches()
+    end = perf_counter() + duration
+    while perf_counter() < end:
+        sensor.get_value()
+        result.reads += 1
+        before = perf_counter()
+        sleep(period)  # sleep(0) still gives the GIL to other threads
+        result.wakeup_waits.append(perf_counter() - before - period)
+    after_voluntary, after_involuntary = context_switches()
+    result.voluntary_switches = after_voluntary - voluntary
+    result.involuntary_switches = after_involuntary - involuntary
+
+
+def run_step(sensors: list, num_threads: int, duration: float, period: float) -> dict:
+    "Run the given number of samplers at once and return their measurements."
+    results = [SamplerResult() for _ in range(num_threads)]
+    start = Barrier(num_threads + 1)
+    threads = [Thread(target=sampler, args=(sensors[n % len(sensors)], duration, period, start, results[n]),
+                      name=f"sampler-{n}", daemon=True) for n in range(num_threads)]
+    memory_before = resident_memory_kb()
+    for thread in threads:
+        thread.start()
+    cpu_start = process_time()
+    start.wait()
+    memory_running = resident_memory_kb()  # all threads are running, before their results grow
+    for thread in threads:
+        thread.join()
+    cpu = process_time() - cpu_start
+    rates = [result.reads / duration for result in results]
+    waits = [wait for result in results for wait in result.wakeup_waits]
+    return {
+        "threads": num_threads,
+        "aggregate_rate_hz": round(sum(rates), 1),
+        "per_thread_rate_hz": [round(rate, 1) for rate in rates],
+        "min_thread_rate_hz": round(min(rates), 1),
+        "mean_wakeup_wait_us": round(mean(waits) * 1e6, 1) if waits else 0,
+        "p99_wakeup_wait_us": round(quantiles(waits, n=100)[98] * 1e6, 1) if len(waits) > 1 else 0,
+        "voluntary_switches_per_s": round(sum(r.voluntary_switches for r in results) / duration),
+        "involuntary_switches_per_s": round(sum(r.involuntary_switches for r in results) / duration),
+        "memory_per_thread_kb": round((memory_running - memory_before) / num_threads, 1),
+        "cpu_usage": round(cpu / duration, 2),  # 1.0 means one core fully busy
+    }
+
+
+def find_knee(steps: list[dict], gain: float = KNEE_GAIN) -> int:
+    "Return the number of threads after which one more thread adds less than the given fraction of total rate."
+    for step, next_step in zip(steps, steps[1:]):
+        if next_step["aggregate_rate_hz"] < step["aggregate_rate_hz"] * (1 + gain):
+            return step["threads"]
+    return steps[-1]["threads"]
+
+
+def print_report(steps: list[dict], knee: int):
+    "Print the measurements as a table, followed by the knee."
+    print(f"{'threads':>7}{'total Hz':>10}{'min Hz':>9}{'wait us':>9}{'p99 us':>9}{'vol cs/s':>10}"
+          f"{'invol cs/s':>11}{'kB/thread':>10}{'cpu':>6}")
+    for s in steps:
+        print(f"{s['threads']:>7}{s['aggregate_rate_hz']:>10}{s['min_thread_rate_hz']:>9}"
+              f"{s['mean_wakeup_wait_us']:>9}{s['p99_wakeup_wait_us']:>9}{s['voluntary_switches_per_s']:>10}"
+              f"{s['involuntary_switches_per_s']:>11}{s['memory_per_thread_kb']:>10}{s['cpu_usage']:>6}")
+    print(f"\nKnee: {knee} thread{'' if knee == 1 else 's'}. More threads than this do not increase the total "
+          f"sampling rate by {KNEE_GAIN:.0%} or more, they only share it and wait longer for the GIL.")
+
+
+if __name__ == "__main__":
+    "Main entry point."
+    parser = ArgumentParser(description="Measure how sampling scales with the number of threads.")
+    parser.add_argument("-threads", type=int, default=8, help="maximum number of sampler threads")
+    parser.add_argument("-duration", type=float, default=2, help="seconds to run each thread count")
+    parser.add_argument("-period", type=float, default=0, help="sleep between reads in seconds, 0 for none")
+    parser.add_argument("-json", help="also write the measurements to this file")
+    parser.add_argument("-sim", action="store_true", help="use the simulated brick instead of the BrickPi")
+    args = parser.parse_args()
+
+    if args.sim:
+        from utils import simulation
+        simulation.install()
+    from utils.brick import EV3ColorSensor, EV3UltrasonicSensor, configure_ports
+
+    sensors = configure_ports(PORT_1=EV3UltrasonicSensor, PORT_2=EV3ColorSensor)
+    steps = []
+    for num_threads in range(1, args.threads + 1):
+        print(f"Running {num_threads} sampler thread{'' if num_threads == 1 else 's'}...")
+        steps.append(run_step(sensors, num_threads, args.duration, args.period))
+    knee = find_knee(steps)
+    print_report(steps, knee)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"period_s": args.period, "knee_threads": knee, "steps": steps}, f, indent=2)
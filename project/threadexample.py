@@ -6,14 +6,18 @@ Simple examples of using threads and sampling rates in the context of the BrickP
 
 from collections import deque
 from statistics import mean
-from time import time, sleep
+from time import time
 from threading import Thread
 from types import FunctionType
 
 from utils.brick import EV3ColorSensor, EV3UltrasonicSensor, Sensor, configure_ports
+from utils.shutdown import SHUTDOWN, sleep
+from utils.telemetry import TelemetrySender
+from utils.watchdog import shared_watchdog
 
 
 US_SENSOR, COLOR_SENSOR = configure_ports(PORT_1=EV3UltrasonicSensor, PORT_2=EV3ColorSensor)
+TELEMETRY = TelemetrySender()  # run telemetry_viewer.py on your computer to plot the samples live
 
 print_red = lambda text: print(f"\033[91m{text}\033[0m")
 print_green = lambda text: print(f"\033[92m{text}\033[0m")
@@ -24,31 +28,38 @@ def determine_max_sensor_sample_rate(sensor: Sensor):
     Determine the maximum sample rate of the given sensor in Hz. Do this by sampling the sensor at
     a known rate of 1 Hz (1 sample per second) and then continuously increasing the sample rate,
     by halving the sleep time, until the number of reads no longer increases.
+    Stops early when the program is stopped, eg with Ctrl-C.
     """
     DEQUE_LEN = 10
     sensor_name = sensor.__class__.__name__
     log: FunctionType = print_red if sensor_name == EV3UltrasonicSensor.__name__ else print_green
+    channel = TELEMETRY.add_channel(sensor_name)
     all_num_reads = deque(maxlen=DEQUE_LEN)  # double-ended queue, FIFO (first-in-first-out)
     num_reads = 0
     sleep_time = sr_timeout = 1  # second
     sr_start = time()
     
-    while True:
-        log(f"{sensor_name}: Using {sleep_time = }")
-        log(f"{sensor_name}: Number of readings: {num_reads}")
-        num_reads = 0
-        while time() - sr_start < sr_timeout:
-            sensor.get_value()
-            num_reads += 1
-            sleep(sleep_time)
-        sleep_time /= 2
-        sr_start = time()
-        all_num_reads.append(num_reads)
-        avg_num_reads = mean(all_num_reads)
-        if num_reads < avg_num_reads:
-            text = f"{sensor_name} max sample rate: {avg_num_reads}"
-            log(f"\n{(eqs := len(text) * '=')}\n{text}\n{eqs}\n\n")
-            break
+    # The watchdog warns if this loop gets stuck, eg in a sensor read, for more than 3 x the longest sleep
+    with shared_watchdog().register(f"{sensor_name} sampler", period=sleep_time) as heartbeat:
+        while not SHUTDOWN.stopping.is_set():
+            log(f"{sensor_name}: Using {sleep_time = }")
+            log(f"{sensor_name}: Number of readings: {num_reads}")
+            num_reads = 0
+            while time() - sr_start < sr_timeout:
+                heartbeat.beat()
+                TELEMETRY.record(channel, sensor.get_value())
+                num_reads += 1
+                # utils.shutdown's sleep() wakes up right away when the program is stopped
+                if sleep(sleep_time):
+                    return
+            sleep_time /= 2
+            sr_start = time()
+            all_num_reads.append(num_reads)
+            avg_num_reads = mean(all_num_reads)
+            if num_reads < avg_num_reads:
+                text = f"{sensor_name} max sample rate: {avg_num_reads}"
+                log(f"\n{(eqs := len(text) * '=')}\n{text}\n{eqs}\n\n")
+                break
 
 
 def determine_max_sensor_sample_rate_multithreaded():
@@ -58,13 +69,20 @@ def determine_max_sensor_sample_rate_multithreaded():
     increasing the sample rate, by halving the sleep time, until the number of reads no longer increases.
     """
     for sensor in (US_SENSOR, COLOR_SENSOR):
-        # the lambda here means that the entire function invocation is first passed to run_in_background() and then run
-        run_in_background(lambda: determine_max_sensor_sample_rate(sensor))
+        # the lambda here means that the entire function invocation is first passed to run_in_background() and then run.
+        # sensor=sensor binds the current sensor when the lambda is created. Without it, the lambda would look up
+        # the loop variable when the thread runs, and both threads could end up using the last sensor
+        run_in_background(lambda sensor=sensor: determine_max_sensor_sample_rate(sensor))
 
 
 def run_in_background(action: FunctionType):
-    "Use to run an action (a function) in the background."
-    return Thread(target=action).start()
+    """
+    Use to run an action (a function) in the background. The thread is registered with SHUTDOWN,
+    so that stopping the program waits for it to finish, up to a deadline.
+    """
+    thread = Thread(target=action)
+    SHUTDOWN.register_thread(thread)
+    return thread.start()
 
 
 if __name__ == "__main__":
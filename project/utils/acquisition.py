@@ -0,0 +1,308 @@
+"""
+Module that moves sensor and motor polling into a dedicated acquisition process, so that heavy
+computation in the control code no longer competes with the sampling threads for the GIL
+(Global Interpreter Lock, which only lets one thread of a process run Python code at a time).
+
+The acquisition process owns the brick: it configures the ports, then polls every device at a
+fixed period and writes timestamped samples into a ring buffer per device, in shared memory.
+Control processes read the latest samples directly from shared memory, through objects with the
+same get_value(), get_status(), and wait_ready() methods as utils.brick sensors.
+
+Example:
+
+acquisition = AcquisitionProcess(PORT_1=EV3UltrasonicSensor, PORT_2=EV3ColorSensor, PORT_A=Motor, period=0.005)
+US_SENSOR, COLOR_SENSOR, MOTOR = acquisition.start()
+while True:
+    distance = US_SENSOR.get_value()  # no bus transfer, just a read from shared memory
+
+Other programs can read the samples too, with attach(name), where name is the name of the shared
+memory, acquisition.memory.name.
+
+Each ring buffer has a seqlock-style header: the writer makes the sequence number odd before it
+writes a sample and even again after, and readers retry when the sequence number was odd or
+changed while they read, so they never see a partially written sample.
+"""
+
+from __future__ import annotations  # not required in Python 3.10+
+from multiprocessing import get_all_start_methods, get_context, resource_tracker
+from multiprocessing.process import BaseProcess
+from multiprocessing.shared_memory import SharedMemory
+from time import monotonic, sleep
+import atexit
+import signal
+import struct
+
+from .shutdown import SHUTDOWN
+
+
+MAGIC = b"BPAQ"
+HEADER = struct.Struct("<4sHHIdd")  # magic, number of channels, stop flag, capacity, start time, period
+CHANNEL_HEADER = struct.Struct("<QQ4s")  # sequence number, number of samples written, port name
+SLOT = struct.Struct("<diB4d")  # monotonic time, status code, number of values, values
+MAX_VALUES = 4  # values per sample, eg [red, green, blue, unknown] or motor [flags, power, encoder, dps]
+
+# Status codes, in the same order as brickpi3's SENSOR_STATE, then the statuses added by Sensor.read()
+STATUS_NAMES = ("VALID_DATA", "NOT_CONFIGURED", "CONFIGURING", "NO_DATA", "I2C_ERROR", "BUS_ERROR", "CIRCUIT_OPEN")
+STATUS_CODES = {name: code for code, name in enumerate(STATUS_NAMES)}
+VALID_DATA, BUS_ERROR = STATUS_CODES["VALID_DATA"], STATUS_CODES["BUS_ERROR"]
+STALE = "STALE"  # returned by get_status() when the latest sample is too old, like Sensor.Status.STALE
+STALE_PERIODS = 5  # periods without a new sample after which the latest one is stale
+MIN_STALE_AGE = 0.02  # seconds, so that a short hiccup of the acquisition process is not reported
+PORT_ORDER = "1234ABCD"  # sensors first then motors, like configure_ports()
+
+# Fork, so the acquisition process inherits utils.brick, and the simulated brick if it is installed,
+# instead of importing it again and taking over the PID file and control socket of this process
+_context = get_context("fork" if "fork" in get_all_start_methods() else None)
+_attached: list[SharedMemory] = []  # shared memory opened by attach(), kept open while this process runs
+
+
+def channel_offset(channel: int, capacity: int) -> int:
+    "Return the offset of the header of the given channel in the shared memory."
+    return HEADER.size + channel * (CHANNEL_HEADER.size + capacity * SLOT.size)
+
+
+class ChannelWriter:
+    "Writes the samples of one device. Only the acquisition process writes."
+
+    def __init__(self, buffer: memoryview, channel: int, capacity: int):
+        self.buffer = buffer
+        self.capacity = capacity
+        self.offset = channel_offset(channel, capacity)
+        self.sequence = self.count = 0
+
+    def write(self, timestamp: float, status: int, value: float | list[float] | None):
+        """
+        Write a sample, overwriting the oldest one when the ring buffer is full. Lists are stored
+        with up to MAX_VALUES items, and None (no valid value) is stored as zero values.
+        """
+        if value is None:
+            values = ()
+        elif isinstance(value, (list, tuple)):
+            values = value[:MAX_VALUES]
+        else:
+            values = (value,)
+        slot = self.offset + CHANNEL_HEADER.size + (self.count % self.capacity) * SLOT.size
+        self.sequence += 1  # odd: write in progress
+        struct.pack_into("<Q", self.buffer, self.offset, self.sequence)
+        SLOT.pack_into(self.buffer, slot, timestamp, status, len(values),
+                       *values, *[0.0] * (MAX_VALUES - len(values)))
+        self.count += 1
+        self.sequence += 1  # even: sample complete
+        struct.pack_into("<QQ", self.buffer, self.offset, self.sequence, self.count)
+
+
+class SharedDevice:
+    """
+    Reads the samples of one device from shared memory. Safe to use from any process or thread.
+    The latest sample is stale, eg because the acquisition process stopped, after max_age seconds.
+    """
+
+    def __init__(self, buffer: memoryview, channel: int, capacity: int, max_age: float = float("inf")):
+        self.buffer = buffer
+        self.capacity = capacity
+        self.max_age = max_age
+        self.offset = channel_offset(channel, capacity)
+        self.port = CHANNEL_HEADER.unpack_from(buffer, self.offset)[2].rstrip(b"\0").decode()
+
+    def get_sample(self) -> tuple[float, int, float | list[float] | None] | None:
+        "Return the latest (time, status code, value) sample, or None if there is none yet."
+        while True:
+            sequence, count, _ = CHANNEL_HEADER.unpack_from(self.buffer, self.offset)
+            if sequence & 1:  # the writer is in the middle of a sample
+                sleep(0)
+                continue
+            if count == 0:
+                return None
+            sample = self._unpack((count - 1) % self.capacity)
+            if CHANNEL_HEADER.unpack_from(self.buffer, self.offset)[0] == sequence:
+                return sample
+
+    def get_samples(self, n: int) -> list[tuple[float, int, float | list[float] | None]]:
+        "Return up to the n latest samples, oldest first."
+        count = CHANNEL_HEADER.unpack_from(self.buffer, self.offset)[1]
+        first = max(0, count - min(n, self.capacity))
+        samples = [self._unpack(index % self.capacity) for index in range(first, count)]
+        # The writer may have overwritten the oldest slots while they were copied, drop those, and the
+        # slot it is writing if the sequence number is odd
+        sequence, count_after, _ = CHANNEL_HEADER.unpack_from(self.buffer, self.offset)
+        overwritten = max(0, count_after + (sequence & 1) - self.capacity - first)
+        return samples[overwritten:]
+
+    def _unpack(self, slot: int) -> tuple[float, int, float | list[float] | None]:
+        "Return the sample in the given slot."
+        timestamp, status, num_values, *values = SLOT.unpack_from(
+            self.buffer, self.offset + CHANNEL_HEADER.size + slot * SLOT.size)
+        value = None if num_values == 0 else values[0] if num_values == 1 else values[:num_values]
+        return timestamp, status, value
+
+    def get_value(self) -> float | list[float] | None:
+        "Get the latest value. May return a float, a list, or None if there is no valid and recent value."
+        sample = self.get_sample()
+        if sample and sample[1] == VALID_DATA and monotonic() - sample[0] <= self.max_age:
+            return sample[2]
+        return None
+
+    def get_status(self) -> str:
+        "Return the status of the latest sample, eg VALID_DATA like Sensor.get_status(), or STALE if it is too old."
+        sample = self.get_sample()
+        if not sample:
+            return "NOT_CONFIGURED"
+        return STALE if monotonic() - sample[0] > self.max_age else STATUS_NAMES[sample[1]]
+
+    def get_age(self) -> float:
+        "Return the number of seconds since the latest sample was taken."
+        sample = self.get_sample()
+        return monotonic() - sample[0] if sample else float("inf")
+
+    def wait_ready(self):
+        "Wait (pause program) until the device has valid data."
+        while self.get_status() != STATUS_NAMES[VALID_DATA]:
+            sleep(0.001)
+
+
+class SharedSensor(SharedDevice):
+    "Sensor read from shared memory."
+
+
+class SharedMotor(SharedDevice):
+    "Motor status read from shared memory. Its value is [flags, power, encoder, dps], like Motor.get_status()."
+
+    def get_status(self) -> list[float] | None:
+        "Return the latest [flags, power, encoder, dps] list, or None if the motor could not be read recently."
+        return self.get_value()
+
+    def get_encoder(self) -> float | None:
+        "Return the latest encoder position in degrees."
+        value = self.get_value()
+        return value[2] if value else None
+
+    def wait_ready(self):
+        "Wait (pause program) until the motor status has been read."
+        while self.get_value() is None:
+            sleep(0.001)
+
+
+def _acquire(name: str, ports: list[tuple[str, str]], capacity: int, period: float):
+    "Entry point of the acquisition process: configure the ports and poll them until asked to stop."
+    from . import brick  # inherited from the parent, see _context, but only this process talks to the brick
+
+    # The parent stops this process with the stop flag, so it must not run the shutdown of utils.brick:
+    # ignore Ctrl-C, which reaches the whole process group, and let terminate() end it right away
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    atexit.unregister(brick.shutdown_at_exit)
+    memory = SharedMemory(name)
+    buffer = memory.buf
+    devices = brick.configure_ports(**{f"PORT_{port}": getattr(brick, type_name) for port, type_name in ports},
+                                    print_status=False)
+    devices = devices if isinstance(devices, list) else [devices]
+    writers = [ChannelWriter(buffer, channel, capacity) for channel in range(len(devices))]
+    reading = brick.SensorReading()
+    next_poll = monotonic()
+    while HEADER.unpack_from(buffer)[2] == 0:
+        for device, writer in zip(devices, writers):
+            if isinstance(device, brick.Motor):
+                try:
+                    value, status = device.get_status(), VALID_DATA
+                except (IOError, ValueError):
+                    value, status = None, BUS_ERROR
+            else:
+                status, value = device.read(reading)
+                status = STATUS_CODES[status]
+            writer.write(monotonic(), status, value)
+        next_poll += period
+        delay = next_poll - monotonic()
+        if delay > 0:
+            sleep(delay)
+        else:  # running late, do not try to catch up with a burst of polls
+            next_poll = monotonic()
+    del buffer, writers
+    memory.close()
+
+
+def _shared_devices(buffer: memoryview) -> list[SharedDevice]:
+    "Return one shared device per channel of the shared memory of an acquisition process."
+    magic, channels, _, capacity, _, period = HEADER.unpack_from(buffer)
+    if magic != MAGIC:
+        raise ValueError("Not the shared memory of an acquisition process.")
+    max_age = max(STALE_PERIODS * period, MIN_STALE_AGE)
+    ports = [CHANNEL_HEADER.unpack_from(buffer, channel_offset(channel, capacity))[2] for channel in range(channels)]
+    return [(SharedMotor if port.rstrip(b"\0").decode() in "ABCD" else SharedSensor)(buffer, channel, capacity, max_age)
+            for channel, port in enumerate(ports)]
+
+
+def attach(name: str) -> list[SharedDevice]:
+    """
+    Return one shared device per port of a running acquisition process, ordered like
+    configure_ports(), from another program. name is the name of its shared memory,
+    acquisition.memory.name. The acquisition process keeps owning the shared memory.
+    """
+    try:
+        memory = SharedMemory(name, track=False)  # Python 3.13+
+    except TypeError:
+        memory = SharedMemory(name)
+        resource_tracker.unregister(memory._name, "shared_memory")  # or it is removed when this program exits
+    _attached.append(memory)
+    return _shared_devices(memory.buf)
+
+
+class AcquisitionProcess:
+    """
+    Process that owns the brick and polls the given ports. Ports are given like configure_ports(),
+    with the sensor or motor class (or class name) for each port.
+    """
+
+    def __init__(self, *, period: float = 0.001, capacity: int = 1024, **ports: type | str):
+        "Poll every period seconds and keep the latest capacity samples of each device."
+        self.period = period
+        self.capacity = capacity
+        self.ports = sorted(((key.replace("PORT_", ""), getattr(device_type, "__name__", device_type))
+                             for key, device_type in ports.items() if device_type),
+                            key=lambda port: PORT_ORDER.index(port[0]))
+        self.memory: SharedMemory | None = None
+        self.process: BaseProcess | None = None
+
+    def start(self) -> SharedDevice | list[SharedDevice]:
+        """
+        Start the acquisition process and wait until every device has valid data. Return one
+        shared device per port, ordered like configure_ports(), or a single one for a single port.
+        """
+        from . import brick  # before forking, so the PID file and control socket of utils.brick are this process's
+        size = channel_offset(len(self.ports), self.capacity)
+        self.memory = SharedMemory(create=True, size=size)
+        HEADER.pack_into(self.memory.buf, 0, MAGIC, len(self.ports), 0, self.capacity, monotonic(), self.period)
+        for channel, (port, _) in enumerate(self.ports):
+            CHANNEL_HEADER.pack_into(self.memory.buf, channel_offset(channel, self.capacity), 0, 0, port.encode())
+        self.process = _context.Process(target=_acquire, args=(self.memory.name, self.ports, self.capacity, self.period),
+                               name="acquisition", daemon=True)
+        self.process.start()
+        SHUTDOWN.register(f"acquisition-{self.process.pid}", wait=self.stop)
+        devices = self.devices()
+        for device in devices:
+            while device.get_value() is None:
+                if not self.process.is_alive():
+                    raise RuntimeError(f"Acquisition process stopped with exit code {self.process.exitcode}.")
+                sleep(0.001)
+        return devices[0] if len(devices) == 1 else devices
+
+    def devices(self) -> list[SharedDevice]:
+        "Return one shared device per port, ordered like configure_ports()."
+        return _shared_devices(self.memory.buf)
+
+    def stop(self, timeout: float = 1) -> bool:
+        """
+        Stop the acquisition process and free the shared memory. Return True if the process stopped
+        by itself within the timeout, False if it had to be terminated.
+        """
+        if self.process is None:
+            return True
+        SHUTDOWN.unregister(f"acquisition-{self.process.pid}")
+        struct.pack_into("<H", self.memory.buf, 6, 1)  # stop flag in HEADER
+        self.process.join(timeout)
+        stopped = not self.process.is_alive()
+        if not stopped:
+            self.process.terminate()
+        self.process = None
+        self.memory.close()
+        self.memory.unlink()
+        return stopped
@@ -7,10 +7,14 @@ Authors: Ryan Au, Younes Boubekeur
 
 from __future__ import annotations  # not required in Python 3.10+
 from brickpi3 import *
-from typing import Literal, Type
+from time import monotonic
+from typing import Callable, Literal, Type
 import atexit
 import os
 import signal
+import sys
+
+from .shutdown import MOTOR, RESET, SHUTDOWN
 
 
 PORTS: dict[str, int] = {
@@ -48,6 +52,49 @@ SENSOR_CODES = RevEnumeration(BrickPi3.SENSOR_STATE)
 BP = BrickPi3()  # The BrickPi3 instance
 
 
+def _word(reply: list[int], index: int) -> int:
+    "Return the unsigned 16-bit value of the two bytes of the reply at the index, most significant first."
+    return reply[index] << 8 | reply[index + 1]
+
+
+def _signed(value: int, bits: int) -> int:
+    "Return the two's complement value of an unsigned value with the given number of bits."
+    return value - (1 << bits) if value & (1 << (bits - 1)) else value
+
+
+# Buttons pressed on each channel of the infrared remote, by code, like brickpi3's get_sensor()
+_REMOTE_BUTTONS = {1: [1, 0, 0, 0, 0], 2: [0, 1, 0, 0, 0], 3: [0, 0, 1, 0, 0], 4: [0, 0, 0, 1, 0],
+                   5: [1, 0, 1, 0, 0], 6: [1, 0, 0, 1, 0], 7: [0, 1, 1, 0, 0], 8: [0, 1, 0, 1, 0],
+                   9: [0, 0, 0, 0, 1], 10: [1, 1, 0, 0, 0], 11: [0, 0, 1, 1, 0]}
+
+_TYPE = BrickPi3.SENSOR_TYPE
+
+# Length of the reply to a sensor read and how to decode the value from it, by sensor type, like
+# brickpi3's get_sensor(). I2C replies also have the input bytes of the port.
+_SENSOR_REPLIES: dict[int, tuple[int, Callable[[list[int]], object]]] = {
+    _TYPE.CUSTOM: (10, lambda r: [(r[8] & 0x0F) << 8 | r[9], (r[8] >> 4) & 0x0F | r[7] << 4,
+                                  r[6] & 0x01, (r[6] >> 1) & 0x01]),
+    _TYPE.I2C: (6, lambda r: r[6:]),
+    **dict.fromkeys([_TYPE.TOUCH, _TYPE.NXT_TOUCH, _TYPE.EV3_TOUCH, _TYPE.NXT_ULTRASONIC, _TYPE.EV3_COLOR_REFLECTED,
+                     _TYPE.EV3_COLOR_AMBIENT, _TYPE.EV3_COLOR_COLOR, _TYPE.EV3_ULTRASONIC_LISTEN,
+                     _TYPE.EV3_INFRARED_PROXIMITY], (7, lambda r: r[6])),
+    _TYPE.NXT_COLOR_FULL: (12, lambda r: [r[6], r[7] << 2 | (r[11] >> 6) & 0x03, r[8] << 2 | (r[11] >> 4) & 0x03,
+                                          r[9] << 2 | (r[11] >> 2) & 0x03, r[10] << 2 | r[11] & 0x03]),
+    **dict.fromkeys([_TYPE.NXT_LIGHT_ON, _TYPE.NXT_LIGHT_OFF, _TYPE.NXT_COLOR_RED, _TYPE.NXT_COLOR_GREEN,
+                     _TYPE.NXT_COLOR_BLUE, _TYPE.NXT_COLOR_OFF], (8, lambda r: _word(r, 6))),
+    **dict.fromkeys([_TYPE.EV3_GYRO_ABS, _TYPE.EV3_GYRO_DPS], (8, lambda r: _signed(_word(r, 6), 16))),
+    **dict.fromkeys([_TYPE.EV3_ULTRASONIC_CM, _TYPE.EV3_ULTRASONIC_INCHES], (8, lambda r: _word(r, 6) / 10)),
+    _TYPE.EV3_COLOR_RAW_REFLECTED: (10, lambda r: [_word(r, 6), _word(r, 8)]),
+    _TYPE.EV3_GYRO_ABS_DPS: (10, lambda r: [_signed(_word(r, 6), 16), _signed(_word(r, 8), 16)]),
+    _TYPE.EV3_COLOR_COLOR_COMPONENTS: (14, lambda r: [_word(r, 6), _word(r, 8), _word(r, 10), _word(r, 12)]),
+    _TYPE.EV3_INFRARED_SEEK: (14, lambda r: [[_signed(r[6 + 2 * i], 8), _signed(r[7 + 2 * i], 8)] for i in range(4)]),
+    _TYPE.EV3_INFRARED_REMOTE: (10, lambda r: [_REMOTE_BUTTONS.get(r[6 + i], [0, 0, 0, 0, 0]) for i in range(4)]),
+}
+_TOUCH_TYPES = (_TYPE.NXT_TOUCH, _TYPE.EV3_TOUCH)  # reported by the brick for ports of type TOUCH
+_PORT_INDEXES = {BrickPi3.PORT_1: 0, BrickPi3.PORT_2: 1, BrickPi3.PORT_3: 2, BrickPi3.PORT_4: 3}
+_STATE_NAMES = tuple(SENSOR_CODES[code] for code in range(5))  # VALID_DATA, ..., I2C_ERROR
+
+
 class ColorMapping:
     """
     Class that maps a color to a numeric code used by the color sensor.
@@ -255,6 +302,116 @@ class Brick(BrickPi3):
 
         raise IOError("get_sensor error: Sensor not configured or not supported.")
 
+    def read_sensor(self, port: Literal[1, 2, 4, 8]) -> tuple[str, object]:
+        """
+        Read a sensor status and value with a single SPI transfer, without raising exceptions.
+        Used by Sensor.read().
+
+        Return (status, value), where status is the name of a SENSOR_STATE code, eg VALID_DATA, or
+        BUS_ERROR if the brick did not answer, and value is None unless status is VALID_DATA.
+        A port without a sensor type is NOT_CONFIGURED, and a port for which the brick still reports
+        another type is CONFIGURING.
+        """
+        port_index = _PORT_INDEXES.get(port)
+        sensor_type = self.SensorType[port_index] if port_index is not None else self.SENSOR_TYPE.NONE
+        reply_format = _SENSOR_REPLIES.get(sensor_type)
+        if reply_format is None:  # no sensor type, eg after the brick was reset, or not a single port
+            return "NOT_CONFIGURED", None
+        length, decode = reply_format
+        if sensor_type == self.SENSOR_TYPE.I2C:
+            length += self.I2CInBytes[port_index]
+        try:
+            reply = self.spi_transfer_array([self.SPI_Address, self.BPSPI_MESSAGE_TYPE.GET_SENSOR_1 + port_index]
+                                            + [0] * (length - 2))
+        except OSError:
+            return "BUS_ERROR", None
+        if reply[3] != 0xA5:
+            return "BUS_ERROR", None
+        if reply[4] != sensor_type and not (sensor_type == self.SENSOR_TYPE.TOUCH and reply[4] in _TOUCH_TYPES):
+            return "CONFIGURING", None
+        if reply[5] != self.SENSOR_STATE.VALID_DATA:
+            return (_STATE_NAMES[reply[5]] if reply[5] < len(_STATE_NAMES) else "BUS_ERROR"), None
+        return "VALID_DATA", decode(reply)
+
+
+class SensorReading:
+    """
+    Result of Sensor.read(). Unpacks like a (status, value) pair:
+
+    status, value = sensor.read()
+
+    status is one of the Sensor.Status values, and value is None unless status is VALID_DATA.
+    timestamp is the monotonic time the last bus read completed, which a CIRCUIT_OPEN reading does
+    not change. Each sensor reuses the same reading for every read, to avoid allocating one per read,
+    so copy the fields to keep them after the next read.
+    """
+    __slots__ = ("status", "value", "timestamp")
+
+    def __init__(self):
+        self.status = Sensor.Status.NOT_CONFIGURED
+        self.value = None
+        self.timestamp = 0.0
+
+    def __iter__(self):
+        yield self.status
+        yield self.value
+
+    def fresh(self, max_age: float) -> tuple[str, float | list[float] | None]:
+        """
+        Return the (status, value) pair, or (STALE, None) if the reading is older than max_age seconds,
+        eg because the thread that reads the sensor is stuck. For readings shared between threads:
+
+        status, value = reading.fresh(0.1)
+        """
+        if monotonic() - self.timestamp > max_age:
+            return Sensor.Status.STALE, None
+        return self.status, self.value
+
+    def __repr__(self):
+        return f"SensorReading({self.status}, {self.value})"
+
+
+class CircuitBreaker:
+    """
+    Retry and circuit breaker policy of Sensor.read(), one per sensor.
+
+    A read that gets no SPI response is retried immediately up to `retries` times. Other failures,
+    eg NO_DATA, are not retried, since the port is unlikely to have data right away. After
+    `failure_threshold` failed reads in a row, the circuit opens: reads return CIRCUIT_OPEN
+    without using the bus for `open_time` seconds, then one probe read is allowed. If the probe
+    fails, the circuit opens again for twice as long, up to `max_open_time` seconds. A successful
+    read closes the circuit. The threshold is high enough that a port that only fails some reads,
+    eg 30% of them, rarely opens the circuit.
+    """
+
+    def __init__(self, retries: int = 1, failure_threshold: int = 10, open_time: float = 0.1,
+                 max_open_time: float = 2.0):
+        self.retries = retries
+        self.failure_threshold = failure_threshold
+        self.open_time = open_time
+        self.max_open_time = max_open_time
+        self.failures = 0  # failed reads in a row
+        self.open_until = 0.0  # monotonic time until which reads are not attempted
+        self.next_open_time = open_time
+        self.times_opened = 0
+
+    def is_open(self, now: float) -> bool:
+        "Return True if reads should not be attempted at the given time."
+        return now < self.open_until
+
+    def succeeded(self):
+        "Record a successful read, which closes the circuit."
+        self.failures = 0
+        self.next_open_time = self.open_time
+
+    def failed(self, now: float):
+        "Record a failed read, which opens the circuit after too many failures in a row."
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            self.open_until = now + self.next_open_time
+            self.next_open_time = min(self.next_open_time * 2, self.max_open_time)
+            self.times_opened += 1
+
 
 class Sensor:
     """
@@ -266,11 +423,16 @@ class Sensor:
         CONFIGURING = "CONFIGURING"
         NO_DATA = "NO_DATA"
         I2C_ERROR = "I2C_ERROR"
+        BUS_ERROR = "BUS_ERROR"  # no SPI response, only returned by read()
+        CIRCUIT_OPEN = "CIRCUIT_OPEN"  # not read since the port keeps failing, only returned by read()
+        STALE = "STALE"  # latest reading is too old, only returned by SensorReading.fresh()
 
     def __init__(self, port: Literal[1, 2, 3, 4]):
         "Initialize sensor with a given port (1, 2, 3, or 4)."
         self.brick = Brick()
         self.port = PORTS[str(port).upper()]
+        self.reading = SensorReading()
+        self.breaker = CircuitBreaker()
 
     def get_status(self):
         """
@@ -300,6 +462,38 @@ class Sensor:
         except SensorError:
             return None
 
+    def read(self, reading: SensorReading = None) -> SensorReading:
+        """
+        Read the sensor without raising exceptions, for fast sampling loops:
+
+        status, value = sensor.read()
+        if status == Sensor.Status.VALID_DATA:
+            ...
+
+        Each read is a single SPI transfer, see Brick.read_sensor(). Reads that get no SPI response
+        are retried and a port that keeps failing is only probed at a low rate, see CircuitBreaker.
+        NOT_CONFIGURED and CONFIGURING, eg right after set_mode(), do not count as failures.
+        The result is stored in the sensor's own reading, or in the given one, which threads that
+        share a sensor should pass to avoid overwriting each other's.
+        """
+        if reading is None:
+            reading = self.reading
+        breaker = self.breaker
+        if breaker.is_open(monotonic()):
+            reading.status, reading.value = Sensor.Status.CIRCUIT_OPEN, None
+            return reading  # keeps the timestamp of the last read, so it goes stale
+        for _ in range(breaker.retries + 1):
+            status, value = self.brick.read_sensor(self.port)
+            if status != Sensor.Status.BUS_ERROR:
+                break
+        reading.status, reading.value = status, value
+        reading.timestamp = now = monotonic()  # last, so that a fresh timestamp comes with the new data
+        if status == Sensor.Status.VALID_DATA:
+            breaker.succeeded()
+        elif status != Sensor.Status.NOT_CONFIGURED and status != Sensor.Status.CONFIGURING:
+            breaker.failed(now)
+        return reading
+
     def wait_ready(self):
         "Wait (pause program) until the sensor is initialized."
         while self.get_status() != Sensor.Status.VALID_DATA:
@@ -593,7 +787,7 @@ class Motor:
             encoder - The encoder position
             dps - The current speed in Degrees Per Second
         """
-        self.brick.get_motor_status(self.port)
+        return self.brick.get_motor_status(self.port)
 
     def get_encoder(self):
         """
@@ -604,7 +798,7 @@ class Motor:
 
         Returns the encoder position in degrees
         """
-        self.brick.get_motor_encoder(self.port)
+        return self.brick.get_motor_encoder(self.port)
 
     def offset_encoder(self, position):
         """
@@ -682,13 +876,54 @@ def configure_ports(*,
 # Save process ID of this program so we can force stop it later if needed
 os.system(f"echo {os.getpid()} > ~/brickpi3_pid")
 
+# Answer stop, reset, status, and metrics commands from other programs, see the control module
+from . import control
+control.start()
+
+
+def stop_motors():
+    "Stop all motors right away, before anything else on shutdown."
+    BP.set_motor_power(BP.PORT_A | BP.PORT_B | BP.PORT_C | BP.PORT_D, 0)
+
 
 def reset_brick(*args):
-    "Reset BrickPi devices when program exits ('at exit')."
+    "Reset BrickPi devices, last on shutdown."
     BP.reset_all()
 
 
-# Reset brick when the program exits
-atexit.register(reset_brick)
-signal.signal(signal.SIGTERM, reset_brick)
-signal.signal(signal.SIGINT, reset_brick)  # Ctrl-C
+def shutdown_at_exit():
+    "Stop motors, background workers, and the brick when the program exits ('at exit')."
+    report = SHUTDOWN.shutdown()
+    if report.overran:
+        print(report)
+
+
+def stop_program(signum: int, frame):
+    """
+    Stop motors, background workers, and the brick, then exit, when Ctrl-C is pressed or the
+    program is asked to terminate. A second signal while stopping exits right away.
+    """
+    if SHUTDOWN.stopping.is_set():
+        os._exit(128 + signum)
+    report = SHUTDOWN.shutdown(signal.Signals(signum).name)
+    print(report)
+    if report.overran:  # threads that did not stop would keep the program from exiting
+        os._exit(128 + signum)
+    sys.exit(128 + signum)
+
+
+SHUTDOWN.register("motors", stop_motors, kind=MOTOR)
+SHUTDOWN.register("brick", reset_brick, kind=RESET)
+atexit.register(shutdown_at_exit)
+signal.signal(signal.SIGTERM, stop_program)
+signal.signal(signal.SIGINT, stop_program)  # Ctrl-C
+
+# Opt-in instrumentation, see the metrics module
+if os.environ.get("BRICK_METRICS"):
+    from . import metrics
+    metrics.enable()
+    metrics.start_dumping()
+if os.environ.get("BRICK_TRACE"):
+    from . import tracing
+    tracing.enable()
+    atexit.register(tracing.export_chrome_trace, os.environ["BRICK_TRACE"])
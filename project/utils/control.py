@@ -0,0 +1,225 @@
+"""
+Module that lets other programs control the running robot program through a socket, in
+milliseconds, instead of starting a new Python interpreter over SSH to reset the brick.
+
+utils.brick starts the control server when it is imported, unless the brick is simulated, on a
+Unix-domain socket for programs on the brick (eg scripts/reset_brick.py), which only the pi user can
+open. The TCP port for the computer (eg deploy_to_robot.py) is only opened when the
+BRICK_CONTROL_SECRET environment variable is set, which deploy_to_robot.py does with the robot
+password, and every command sent over TCP must be signed with that secret.
+
+Protocol: the client sends one command per line, and the server answers each with one line of JSON.
+Over TCP, the server first sends {"nonce": NONCE}, and the client sends "COMMAND SIGNATURE" lines,
+where SIGNATURE is the hex HMAC-SHA256 of "NONCE COMMAND" with the secret as key.
+Commands:
+- stop: stop the program like Ctrl-C (motors, then background threads, then the brick). Answers
+  right away, use stop_program() to wait until the program has exited.
+- reset: stop the motors and reset the brick, without stopping the program
+- status: process ID, program, uptime, whether it is stopping, and running threads
+- metrics: snapshot of the metrics module, see utils.metrics
+
+Example, from the brick:
+
+send_command("status")  # None if no program is running
+stop_program()  # True once the program has exited
+
+or from a shell: echo status | nc -U ~/brickpi3.sock
+"""
+
+from __future__ import annotations  # not required in Python 3.10+
+from socketserver import StreamRequestHandler, ThreadingTCPServer
+from threading import Thread, enumerate as all_threads
+from time import monotonic, sleep
+import atexit
+import hashlib
+import hmac
+import json
+import os
+import signal
+import socket
+import sys
+
+
+CONTROL_SOCKET = "~/brickpi3.sock"  # Unix-domain socket, next to ~/brickpi3_pid
+CONTROL_PORT = 2111  # TCP port, next to the telemetry port
+SECRET_VARIABLE = "BRICK_CONTROL_SECRET"  # environment variable with the secret of the TCP port
+TIMEOUT = 1.0  # seconds clients wait to connect and for an answer
+POLL_INTERVAL = 0.05  # seconds, how long closing the servers can take, and between status checks
+STOP_DEADLINE = 3.0  # seconds stop_program() waits for the program to exit, more than the shutdown deadline
+
+_start_time = monotonic()
+_servers: list[ThreadingTCPServer] = []
+
+
+def stop() -> dict:
+    "Stop the program like Ctrl-C. Answers right away, the shutdown then runs on the main thread."
+    os.kill(os.getpid(), signal.SIGINT)
+    return {"stopping": True}
+
+
+def reset() -> dict:
+    "Stop the motors and reset the brick, without stopping the program."
+    from . import brick
+    brick.stop_motors()
+    brick.reset_brick()
+    return {"reset": True}
+
+
+def status() -> dict:
+    "Return what the program is and what it is doing."
+    from .shutdown import SHUTDOWN
+    return {
+        "pid": os.getpid(),
+        "program": sys.argv[0],
+        "uptime_s": round(monotonic() - _start_time, 3),
+        "stopping": SHUTDOWN.stopping.is_set(),
+        "threads": [thread.name for thread in all_threads()],
+    }
+
+
+def metrics_snapshot() -> dict:
+    "Return the metrics collected so far, empty unless they were enabled."
+    from . import metrics
+    return metrics.snapshot()
+
+
+COMMANDS = {"stop": stop, "reset": reset, "status": status, "metrics": metrics_snapshot}
+
+
+def sign(secret: str, nonce: str, command: str) -> str:
+    "Return the signature of a command sent over TCP, for the nonce of the connection."
+    return hmac.new(secret.encode(), f"{nonce} {command}".encode(), hashlib.sha256).hexdigest()
+
+
+class ControlHandler(StreamRequestHandler):
+    "Answers the commands of one client connection, checking their signatures if the server has a secret."
+
+    def handle(self):
+        secret = self.server.secret
+        if secret:
+            nonce = os.urandom(16).hex()
+            self.wfile.write(json.dumps({"nonce": nonce}).encode() + b"\n")
+        for line in self.rfile:
+            command = line.decode(errors="replace").strip()
+            if not command:
+                continue
+            if secret:
+                command, _, signature = command.rpartition(" ")
+                if not hmac.compare_digest(signature, sign(secret, nonce, command)):
+                    self.wfile.write(json.dumps({"ok": False, "error": "Bad signature."}).encode() + b"\n")
+                    return  # drop the connection, the client needs the secret
+            try:
+                answer = {"ok": True, **COMMANDS[command]()} if command in COMMANDS else {
+                    "ok": False, "error": f"Unknown command {command!r}, expected one of {', '.join(COMMANDS)}."}
+            except Exception as e:
+                answer = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+            self.wfile.write(json.dumps(answer).encode() + b"\n")
+
+
+class ControlTCPServer(ThreadingTCPServer):
+    "TCP server that can restart on the same port right after the previous program exits."
+    allow_reuse_address = True
+    daemon_threads = True
+    secret: str | None = None  # commands must be signed with it, if set
+
+
+if hasattr(socket, "AF_UNIX"):  # not on Windows, where deploy_to_robot.py may import this module
+    class ControlUnixServer(ControlTCPServer):
+        "Unix-domain socket server."
+        address_family = socket.AF_UNIX
+
+        def server_bind(self):
+            "Bind without the TCP socket options."
+            self.socket.bind(self.server_address)
+
+
+def start(path: str = CONTROL_SOCKET, port: int = CONTROL_PORT, secret: str = None):
+    """
+    Start answering commands in the background, on the Unix-domain socket at the given path, and on
+    the given TCP port if there is a secret, from the BRICK_CONTROL_SECRET environment variable by
+    default. Nothing is started when the brick is simulated, eg in benchmarks. A socket that cannot
+    be opened, eg because another program already uses it, is skipped with a warning.
+    """
+    from .simulation import is_installed
+    if is_installed():
+        return
+    path = os.path.expanduser(path)
+    secret = secret or os.environ.get(SECRET_VARIABLE)
+    started = len(_servers)
+    if os.path.exists(path):
+        if send_command("status", path=path) is not None:
+            print(f"Control socket {path} not available: used by another running program")
+        else:  # left behind by a previous program, like ~/brickpi3_pid
+            os.unlink(path)
+    if not os.path.exists(path):
+        try:
+            _servers.append(ControlUnixServer(path, ControlHandler))
+            os.chmod(path, 0o600)  # only the user running the program
+        except (OSError, NameError) as e:  # NameError: no Unix-domain sockets (Windows)
+            print(f"Control socket {path} not available: {e}")
+    if port and secret:
+        try:
+            server = ControlTCPServer(("", port), ControlHandler)
+            server.secret = secret
+            _servers.append(server)
+        except OSError as e:
+            print(f"Control port {port} not available: {e}")
+    for server in _servers[started:]:
+        Thread(target=server.serve_forever, args=(POLL_INTERVAL,), name="control", daemon=True).start()
+    atexit.register(close)
+
+
+def close():
+    "Stop answering commands and remove the Unix-domain socket."
+    while _servers:
+        server = _servers.pop()
+        server.shutdown()
+        server.server_close()
+        if isinstance(server.server_address, str) and os.path.exists(server.server_address):
+            os.unlink(server.server_address)
+
+
+def send_command(command: str, host: str = None, port: int = CONTROL_PORT, path: str = CONTROL_SOCKET,
+                 secret: str = None, timeout: float = TIMEOUT) -> dict | None:
+    """
+    Send a command to the running program and return its answer, or None if no program answered.
+    Uses the Unix-domain socket at the given path, or the TCP port of the given host if there is one,
+    signing the command with the secret, from the BRICK_CONTROL_SECRET environment variable by default.
+    """
+    try:
+        if host:
+            client = socket.create_connection((host, port), timeout)
+        else:
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            client.settimeout(timeout)
+            client.connect(os.path.expanduser(path))
+        with client:
+            answers = client.makefile("rb")
+            if host:
+                nonce = json.loads(answers.readline())["nonce"]
+                command = f"{command} {sign(secret or os.environ.get(SECRET_VARIABLE, ''), nonce, command)}"
+            client.sendall(command.encode() + b"\n")
+            answer = answers.readline()
+        return json.loads(answer) if answer else None
+    except (OSError, AttributeError, ValueError, KeyError):
+        return None
+
+
+def stop_program(host: str = None, secret: str = None, deadline: float = STOP_DEADLINE, **kwargs) -> bool:
+    """
+    Ask the running program to stop, and wait until it has exited, checking its status every
+    POLL_INTERVAL seconds. Return True if it exited before the deadline, False if no program
+    answered, or if it is still running, eg stuck in an SPI transfer, so the caller can reset the
+    brick and kill the program itself. Other arguments are passed to send_command().
+    """
+    running = send_command("status", host, secret=secret, **kwargs)
+    if running is None or "pid" not in running:  # no program, or a wrong secret
+        return False
+    send_command("stop", host, secret=secret, **kwargs)
+    end = monotonic() + deadline
+    while monotonic() < end:
+        sleep(POLL_INTERVAL)
+        answer = send_command("status", host, secret=secret, **kwargs)
+        if answer is None or answer.get("pid") != running["pid"]:
+            return True
+    return False
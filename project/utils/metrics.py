@@ -0,0 +1,255 @@
+"""
+Module that measures where time goes when talking to the BrickPi: call counts, error counts, and
+latency histograms for each sensor and motor operation, per port.
+
+Instrumentation is opt-in. enable() wraps the measured methods of utils.brick and disable()
+puts the original methods back, so when it is off there is no overhead at all. Set the
+BRICK_METRICS environment variable to enable it and dump the metrics to a file every few
+seconds and when the program stops, without changing any code:
+
+BRICK_METRICS=1 python3 project/threadexample.py
+
+Run `python3 -m utils.metrics` from the project folder to benchmark the overhead.
+"""
+
+from __future__ import annotations  # not required in Python 3.10+
+from threading import Event, Lock, Thread
+from time import perf_counter_ns, time
+from types import FunctionType
+import json
+import os
+
+from . import patching
+from .shutdown import SHUTDOWN
+
+
+METRICS_FILE = "~/brickpi3_metrics.json"  # on the brick
+DUMP_INTERVAL = 5  # seconds
+
+# Latency histogram buckets: bucket 0 counts calls under 1 us, bucket i counts calls from
+# 2**(i-1) us (inclusive) to 2**i us (exclusive), and the last bucket also counts anything slower
+NUM_BUCKETS = 22
+BUCKET_BOUNDS_US = [2 ** i for i in range(NUM_BUCKETS - 1)]  # upper bounds, except the last bucket
+
+
+class OperationStats:
+    "Counters of one operation on one port. The histogram is preallocated."
+    __slots__ = ("calls", "errors", "total_ns", "max_ns", "buckets", "lock")
+
+    def __init__(self):
+        self.calls = self.errors = self.total_ns = self.max_ns = 0
+        self.buckets = [0] * NUM_BUCKETS
+        self.lock = Lock()
+
+    def record(self, duration_ns: int, error: bool):
+        "Count one call that took the given time."
+        with self.lock:
+            self.calls += 1
+            self.errors += error
+            self.total_ns += duration_ns
+            if duration_ns > self.max_ns:
+                self.max_ns = duration_ns
+            self.buckets[min((duration_ns // 1000).bit_length(), NUM_BUCKETS - 1)] += 1
+
+    def percentile_us(self, fraction: float) -> float:
+        "Return an upper bound of the given percentile (0 to 1) of the latency, from the histogram."
+        target, seen = fraction * self.calls, 0
+        for bound, count in zip(BUCKET_BOUNDS_US, self.buckets):
+            seen += count
+            if seen >= target:
+                return min(bound, round(self.max_ns / 1000, 1))
+        return round(self.max_ns / 1000, 1)
+
+    def to_dict(self) -> dict:
+        "Return the counters and derived statistics as a JSON-serializable dictionary."
+        with self.lock:
+            return {
+                "calls": self.calls,
+                "errors": self.errors,
+                "mean_us": round(self.total_ns / self.calls / 1000, 1) if self.calls else 0,
+                "p50_us": self.percentile_us(0.5),
+                "p99_us": self.percentile_us(0.99),
+                "max_us": round(self.max_ns / 1000, 1),
+                "histogram": list(self.buckets),
+            }
+
+
+_stats: dict[tuple[str, str], OperationStats] = {}  # by (operation, port name)
+_stats_lock = Lock()
+_enabled_at: float | None = None
+
+
+def get_stats(operation: str, port: str) -> OperationStats:
+    "Return the counters of the given operation and port, creating them if needed."
+    stats = _stats.get((operation, port))
+    if stats is None:
+        with _stats_lock:
+            stats = _stats.setdefault((operation, port), OperationStats())
+    return stats
+
+
+def instrument(operation: str, function: FunctionType, port_of: FunctionType,
+               is_error: FunctionType = None) -> FunctionType:
+    """
+    Return a wrapper of the function that records its latency under the given operation name and
+    the port returned by port_of(args). Raised exceptions count as errors, as do results for which
+    is_error(result) is True (for methods that return their errors instead of raising them).
+    """
+    def wrapper(*args, **kwargs):
+        start = perf_counter_ns()
+        error = True
+        try:
+            result = function(*args, **kwargs)
+            error = is_error is not None and is_error(result)
+            return result
+        finally:
+            get_stats(operation, port_of(args)).record(perf_counter_ns() - start, error)
+    wrapper.__name__, wrapper.__doc__, wrapper.__wrapped__ = function.__name__, function.__doc__, function
+    return wrapper
+
+
+def _patch(cls: type, name: str, operation: str, port_of: FunctionType, is_error: FunctionType = None):
+    "Wrap a method of the class with an instrumented one, which disable() removes, see utils.patching."
+    patching.patch("metrics", cls, name, lambda function: instrument(operation, function, port_of, is_error))
+
+
+def is_enabled() -> bool:
+    "Return True if instrumentation is enabled."
+    return _enabled_at is not None
+
+
+def enable():
+    "Start measuring the sensor and motor operations of utils.brick. Does nothing if already enabled."
+    global _enabled_at
+    if is_enabled():
+        return
+    from . import brick  # imported here since importing utils.brick connects to the BrickPi
+
+    sensor_port_names = {brick.PORTS[name]: name for name in "1234"}
+    brick_port = lambda args: sensor_port_names.get(args[1], str(args[1]))
+    sensor_port = lambda args: sensor_port_names.get(args[0].port, str(args[0].port))
+    motor_port = lambda args: "".join(name for name in "ABCD" if args[0].port & brick.PORTS[name])  # eg "AC"
+
+    _patch(brick.Brick, "get_sensor_status", "Brick.get_sensor_status", brick_port)
+    _patch(brick.Brick, "get_sensor", "Brick.get_sensor", brick_port)
+    _patch(brick.Brick, "read_sensor", "Brick.read_sensor", brick_port, lambda result: result[0] != "VALID_DATA")
+    _patch(brick.Sensor, "get_value", "Sensor.get_value", sensor_port, lambda value: value is None)
+    _patch(brick.Sensor, "read", "Sensor.read", sensor_port, lambda reading: reading.status != "VALID_DATA")
+    _patch(brick.Sensor, "wait_ready", "Sensor.wait_ready", sensor_port)
+    for sensor_class in brick.Sensor.__subclasses__():
+        if "set_mode" in sensor_class.__dict__:
+            _patch(sensor_class, "set_mode", f"{sensor_class.__name__}.set_mode", sensor_port)
+    for name, method in list(brick.Motor.__dict__.items()):
+        if callable(method) and not name.startswith("_") and name != "set_port":
+            _patch(brick.Motor, name, f"Motor.{name}", motor_port)
+    _enabled_at = time()
+
+
+def disable():
+    "Stop measuring and restore the original methods. The metrics collected so far are kept."
+    global _enabled_at
+    patching.unpatch("metrics")
+    _enabled_at = None
+
+
+def reset():
+    "Forget all metrics collected so far."
+    with _stats_lock:
+        _stats.clear()
+
+
+def snapshot() -> dict:
+    """
+    Return all metrics as a JSON-serializable dictionary of the form
+    {"enabled": bool, "time": float, "uptime_s": float, "bucket_bounds_us": [...],
+     "operations": {operation: {port: {"calls": int, "errors": int, "mean_us": float, ...}}}}.
+    """
+    with _stats_lock:
+        items = sorted(_stats.items())
+    operations: dict[str, dict[str, dict]] = {}
+    for (operation, port), stats in items:
+        operations.setdefault(operation, {})[port] = stats.to_dict()
+    return {
+        "enabled": is_enabled(),
+        "time": time(),
+        "uptime_s": round(time() - _enabled_at, 3) if is_enabled() else 0,
+        "bucket_bounds_us": BUCKET_BOUNDS_US,
+        "operations": operations,
+    }
+
+
+def format_text(metrics: dict) -> str:
+    "Return a snapshot as a human-readable table."
+    lines = [f"{'operation':<32}{'port':>5}{'calls':>10}{'errors':>8}{'mean us':>10}{'p50 us':>9}"
+             f"{'p99 us':>9}{'max us':>10}"]
+    for operation, ports in metrics["operations"].items():
+        for port, s in ports.items():
+            lines.append(f"{operation:<32}{port:>5}{s['calls']:>10}{s['errors']:>8}{s['mean_us']:>10}"
+                         f"{s['p50_us']:>9}{s['p99_us']:>9}{s['max_us']:>10}")
+    return "\n".join(lines) + "\n"
+
+
+def dump(path: str = METRICS_FILE):
+    "Write a snapshot to the file, as a text table if the path ends with .txt, as JSON otherwise."
+    path = os.path.expanduser(path)
+    metrics = snapshot()
+    with open(f"{path}.tmp", "w") as f:  # write then rename, so readers never see a partial file
+        if path.endswith(".txt"):
+            f.write(format_text(metrics))
+        else:
+            json.dump(metrics, f, indent=2)
+    os.replace(f"{path}.tmp", path)
+
+
+def start_dumping(path: str = METRICS_FILE, interval: float = DUMP_INTERVAL) -> Thread:
+    """
+    Dump the metrics to the file every interval seconds in a background thread, and a last time when
+    the program stops, so that short runs and the end of long ones are not lost.
+    """
+    stop = Event()
+
+    def dump_periodically():
+        while not stop.wait(interval):
+            dump(path)
+        dump(path)
+    thread = Thread(target=dump_periodically, name="metrics-dump", daemon=True)
+    SHUTDOWN.register_thread(thread, stop.set)
+    thread.start()
+    return thread
+
+
+def benchmark(calls: int = 200_000) -> dict[str, float]:
+    """
+    Return the average cost in nanoseconds of calling a trivial method when instrumentation is
+    disabled (the original method) and enabled (the instrumented wrapper), plus the overhead.
+    Does not need the BrickPi.
+    """
+    class Device:
+        port = 1
+
+        def read(self):
+            return 0
+
+    def time_calls() -> float:
+        device = Device()
+        read = device.read
+        start = perf_counter_ns()
+        for _ in range(calls):
+            read()
+        return (perf_counter_ns() - start) / calls
+
+    original = Device.read
+    disabled_ns = time_calls()
+    Device.read = instrument("Device.read", original, lambda args: str(args[0].port))
+    enabled_ns = time_calls()
+    Device.read = original
+    with _stats_lock:
+        _stats.pop(("Device.read", "1"), None)
+    return {"disabled_ns": disabled_ns, "enabled_ns": enabled_ns, "overhead_ns": enabled_ns - disabled_ns}
+
+
+if __name__ == "__main__":
+    "Benchmark the instrumentation overhead."
+    results = benchmark()
+    print(f"Disabled: {results['disabled_ns']:.0f} ns per call (the original method is called directly)")
+    print(f"Enabled:  {results['enabled_ns']:.0f} ns per call ({results['overhead_ns']:.0f} ns overhead)")
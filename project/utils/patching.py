@@ -0,0 +1,57 @@
+"""
+Module that lets several tools, eg metrics and tracing, wrap the same methods and functions at the
+same time, and remove their wrappers in any order.
+
+A tool patches an attribute of a class or module with a wrap function, which takes the function to
+wrap and returns its wrapper. The attribute is then rebuilt from its original value and the wrap
+functions of every tool that still patches it, in the order they were added. So removing the
+wrappers of one tool keeps the wrappers of the others, instead of restoring a stale copy.
+
+Example:
+
+patch("metrics", Sensor, "get_value", lambda function: instrument("Sensor.get_value", function, ...))
+unpatch("metrics")  # Sensor.get_value is the original again, or only has the wrappers of other tools
+"""
+
+from __future__ import annotations  # not required in Python 3.10+
+from threading import Lock
+from typing import Callable
+
+
+# By (class or module, attribute name): the original value (None if inherited) and the (tool, wrap) pairs
+_patches: dict[tuple[object, str], tuple[object | None, list[tuple[str, Callable]]]] = {}
+_lock = Lock()
+
+
+def patch(tool: str, owner: object, attribute: str, wrap: Callable[[Callable], Callable]):
+    "Wrap an attribute of a class or module with wrap(function), on top of the wrappers of other tools."
+    with _lock:
+        _, wraps = _patches.setdefault((owner, attribute), (owner.__dict__.get(attribute), []))
+        wraps.append((tool, wrap))
+        _rebuild(owner, attribute)
+
+
+def unpatch(tool: str):
+    "Remove all the wrappers of the tool, keeping the wrappers of other tools."
+    with _lock:
+        for (owner, attribute), (_, wraps) in list(_patches.items()):
+            if any(wrap_tool == tool for wrap_tool, _ in wraps):
+                wraps[:] = [(wrap_tool, wrap) for wrap_tool, wrap in wraps if wrap_tool != tool]
+                _rebuild(owner, attribute)
+                if not wraps:
+                    del _patches[(owner, attribute)]
+
+
+def _rebuild(owner: object, attribute: str):
+    "Set the attribute to its original value wrapped by every remaining wrap function, in order."
+    original, wraps = _patches[(owner, attribute)]
+    if original is None:  # inherited, eg a method of a parent class
+        if attribute in owner.__dict__:
+            delattr(owner, attribute)
+        function = getattr(owner, attribute)
+    else:
+        function = original
+    for _, wrap in wraps:
+        function = wrap(function)
+    if wraps or original is not None:
+        setattr(owner, attribute, function)
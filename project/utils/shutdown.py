@@ -0,0 +1,152 @@
+"""
+Module that stops the program quickly and safely, eg when Ctrl-C is pressed.
+
+Parts of the program that run in the background register how to stop them with SHUTDOWN, the
+coordinator shared by the whole program. On shutdown, the coordinator:
+
+1. stops the motors, first, since they are the only thing that can hurt someone or the robot
+2. asks every background worker to stop, then waits for them, up to a shared deadline
+3. resets the brick
+
+and reports how long each step took and which components did not stop before the deadline.
+utils.brick starts a shutdown when the program receives SIGINT (Ctrl-C) or SIGTERM, and when
+it exits normally.
+
+Example, for a thread that loops until the program stops:
+
+def sample():
+    while not SHUTDOWN.stopping.is_set():
+        ...
+        sleep(0.01)  # this module's sleep(), which wakes up right away on shutdown
+
+thread = Thread(target=sample)
+SHUTDOWN.register_thread(thread)
+thread.start()
+"""
+
+from __future__ import annotations  # not required in Python 3.10+
+from threading import Event, Lock, Thread
+from time import monotonic
+from traceback import print_exc
+from typing import Callable
+
+
+DEADLINE = 2.0  # seconds that workers have to stop in total
+
+MOTOR, WORKER, RESET = "motor", "worker", "reset"  # kinds of components, stopped in this order
+
+
+class Component:
+    "Something that must be stopped on shutdown."
+    __slots__ = ("name", "kind", "stop", "wait", "thread")
+
+    def __init__(self, name: str, kind: str, stop: Callable[[], None] = None,
+                 wait: Callable[[float], bool] = None, thread: Thread = None):
+        self.name = name
+        self.kind = kind
+        self.stop = stop  # asks the component to stop, should not block
+        self.wait = wait  # waits up to the given number of seconds, returns True if stopped
+        self.thread = thread
+
+
+class ShutdownReport:
+    "How long the shutdown took and which components did not stop in time."
+
+    def __init__(self, reason: str):
+        self.reason = reason
+        self.durations: dict[str, float] = {}  # seconds each component took to stop
+        self.overran: list[str] = []  # components that did not stop before the deadline or failed
+        self.total = 0.0
+
+    def __str__(self):
+        lines = [f"Shutdown ({self.reason}) took {self.total * 1000:.0f} ms"]
+        lines += [f"  {name}: {duration * 1000:.0f} ms{' (overran)' if name in self.overran else ''}"
+                  for name, duration in self.durations.items()]
+        return "\n".join(lines)
+
+
+class ShutdownCoordinator:
+    "Stops registered components in order: motors, then workers within a deadline, then the brick."
+
+    def __init__(self, deadline: float = DEADLINE):
+        self.deadline = deadline
+        self.stopping = Event()  # set when the shutdown starts, workers can check or wait on it
+        self.report: ShutdownReport | None = None
+        self._components: list[Component] = []
+        self._lock = Lock()
+        self._shutdown_lock = Lock()
+
+    def register(self, name: str, stop: Callable[[], None] = None, wait: Callable[[float], bool] = None,
+                 kind: str = WORKER):
+        """
+        Register a component to stop on shutdown. stop() should only ask the component to stop, and
+        wait(timeout) should wait for it to finish and return True if it did in time.
+        """
+        with self._lock:
+            # Forget threads that already finished, so that short-lived threads do not accumulate
+            self._components = [c for c in self._components if c.thread is None or c.thread.is_alive()
+                                or not c.thread.ident]
+            self._components.append(Component(name, kind, stop, wait))
+
+    def register_thread(self, thread: Thread, stop: Callable[[], None] = None):
+        """
+        Register a thread that stops when stopping is set or when stop() is called. The thread is
+        waited for with the deadline. Daemon threads that never finish are reported as overran.
+        """
+        def wait(timeout: float) -> bool:
+            if thread.ident:  # started
+                thread.join(timeout)
+            return not thread.is_alive()
+        with self._lock:
+            self._components = [c for c in self._components if c.thread is None or c.thread.is_alive()
+                                or not c.thread.ident]
+            self._components.append(Component(thread.name, WORKER, stop, wait, thread))
+
+    def unregister(self, name: str):
+        "Forget the components with the given name."
+        with self._lock:
+            self._components = [c for c in self._components if c.name != name]
+
+    def shutdown(self, reason: str = "exit") -> ShutdownReport:
+        "Stop everything and return the report. Only the first call stops, later calls return the same report."
+        with self._shutdown_lock:
+            if self.report is not None:
+                return self.report
+            report = ShutdownReport(reason)
+            start = monotonic()
+            self.stopping.set()
+            with self._lock:
+                components = list(self._components)
+            for kind in (MOTOR, WORKER, RESET):
+                self._stop_all([c for c in components if c.kind == kind], report, start)
+            report.total = monotonic() - start
+            self.report = report
+            return report
+
+    def _stop_all(self, components: list[Component], report: ShutdownReport, start: float):
+        "Ask all the components to stop, then wait for them until the deadline."
+        phase_start = monotonic()
+        for component in components:
+            try:
+                if component.stop:
+                    component.stop()
+            except Exception:
+                print_exc()
+                report.overran.append(component.name)
+        for component in components:
+            try:
+                stopped = component.wait(max(0.0, start + self.deadline - monotonic())) if component.wait else True
+            except Exception:
+                print_exc()
+                stopped = False
+            report.durations[component.name] = monotonic() - phase_start
+            if not stopped and component.name not in report.overran:
+                report.overran.append(component.name)
+
+
+SHUTDOWN = ShutdownCoordinator()  # shared by the whole program
+
+
+def sleep(seconds: float) -> bool:
+    "Like time.sleep(), but wake up right away when the program stops. Return True if it is stopping."
+    return SHUTDOWN.stopping.wait(seconds)
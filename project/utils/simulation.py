@@ -0,0 +1,295 @@
+"""
+Module that simulates the BrickPi3, to run and benchmark code without a robot.
+
+Call install() before importing utils.brick, which then uses the simulated brick instead of the
+brickpi3 library:
+
+from utils import simulation
+simulation.install()
+from utils.brick import EV3UltrasonicSensor, configure_ports
+
+The simulated brick implements the parts of the brickpi3 API used by utils.brick. Every SPI
+transfer holds a shared bus lock for transfer_time seconds, like the real SPI bus, so thread
+contention behaves realistically. Sensors report CONFIGURING for configure_time seconds after
+their type is set. Sensor values and transient read failures can be controlled from tests with
+the sim_* methods.
+
+utils.brick.Brick copies the attributes of the BrickPi3 instance, so all simulation state is
+kept in mutable objects that are shared by the copies, and only changed in place.
+"""
+
+from __future__ import annotations  # not required in Python 3.10+
+from math import sin
+from random import Random
+from threading import Lock
+from time import monotonic, sleep
+from types import ModuleType
+from typing import Callable
+import sys
+
+
+TRANSFER_TIME = 0.0002  # seconds per SPI transfer
+CONFIGURE_TIME = 0.01  # seconds a sensor reports CONFIGURING after its type is set
+
+
+class Enumeration:
+    "Simplified brickpi3.Enumeration: names separated by commas, numbered from the given start."
+
+    def __init__(self, names: str, start: int = 0):
+        for number, name in enumerate((name.strip() for name in names.split(",") if name.strip()), start):
+            setattr(self, name, number)
+
+
+class SensorError(Exception):
+    "Raised by the simulated brick when a sensor read fails, like brickpi3.SensorError."
+
+
+class SimBrickPi3:
+    "Simulated brickpi3.BrickPi3."
+    PORT_1, PORT_2, PORT_3, PORT_4 = 0x01, 0x02, 0x04, 0x08
+    PORT_A, PORT_B, PORT_C, PORT_D = 0x01, 0x02, 0x04, 0x08
+    MOTOR_FLOAT = -128
+
+    SENSOR_TYPE = Enumeration("""
+        NONE, I2C, CUSTOM, TOUCH, NXT_TOUCH, EV3_TOUCH, NXT_LIGHT_ON, NXT_LIGHT_OFF, NXT_COLOR_RED,
+        NXT_COLOR_GREEN, NXT_COLOR_BLUE, NXT_COLOR_FULL, NXT_COLOR_OFF, NXT_ULTRASONIC, EV3_GYRO_ABS,
+        EV3_GYRO_DPS, EV3_GYRO_ABS_DPS, EV3_COLOR_REFLECTED, EV3_COLOR_AMBIENT, EV3_COLOR_COLOR,
+        EV3_COLOR_RAW_REFLECTED, EV3_COLOR_COLOR_COMPONENTS, EV3_ULTRASONIC_CM, EV3_ULTRASONIC_INCHES,
+        EV3_ULTRASONIC_LISTEN, EV3_INFRARED_PROXIMITY, EV3_INFRARED_SEEK, EV3_INFRARED_REMOTE""", start=1)
+    SENSOR_STATE = Enumeration("VALID_DATA, NOT_CONFIGURED, CONFIGURING, NO_DATA, I2C_ERROR")
+    BPSPI_MESSAGE_TYPE = Enumeration("""
+        NONE, GET_MANUFACTURER, GET_NAME, GET_HARDWARE_VERSION, GET_FIRMWARE_VERSION, GET_ID, SET_LED,
+        GET_VOLTAGE_3V3, GET_VOLTAGE_5V, GET_VOLTAGE_9V, GET_VOLTAGE_VCC, SET_ADDRESS, SET_SENSOR_TYPE,
+        GET_SENSOR_1, GET_SENSOR_2, GET_SENSOR_3, GET_SENSOR_4, I2C_TRANSACT_1, I2C_TRANSACT_2,
+        I2C_TRANSACT_3, I2C_TRANSACT_4, SET_MOTOR_POWER, SET_MOTOR_POSITION, SET_MOTOR_POSITION_KP,
+        SET_MOTOR_POSITION_KD, SET_MOTOR_DPS, SET_MOTOR_DPS_KP, SET_MOTOR_DPS_KD, SET_MOTOR_LIMITS,
+        OFFSET_MOTOR_ENCODER, GET_MOTOR_A_ENCODER, GET_MOTOR_B_ENCODER, GET_MOTOR_C_ENCODER,
+        GET_MOTOR_D_ENCODER, GET_MOTOR_A_STATUS, GET_MOTOR_B_STATUS, GET_MOTOR_C_STATUS, GET_MOTOR_D_STATUS""")
+
+    # Simulated values by sensor type, as functions of the time in seconds
+    DEFAULT_VALUES: dict[int, Callable[[float], object]] = {
+        SENSOR_TYPE.TOUCH: lambda t: 0,
+        SENSOR_TYPE.EV3_TOUCH: lambda t: 0,
+        SENSOR_TYPE.EV3_ULTRASONIC_CM: lambda t: round(30 + 10 * sin(t), 1),
+        SENSOR_TYPE.EV3_ULTRASONIC_INCHES: lambda t: round((30 + 10 * sin(t)) / 2.54, 1),
+        SENSOR_TYPE.EV3_ULTRASONIC_LISTEN: lambda t: 0,
+        SENSOR_TYPE.EV3_COLOR_COLOR_COMPONENTS: lambda t: [120, 80, 40, 0],
+        SENSOR_TYPE.EV3_COLOR_AMBIENT: lambda t: 10,
+        SENSOR_TYPE.EV3_COLOR_REFLECTED: lambda t: 40,
+        SENSOR_TYPE.EV3_COLOR_RAW_REFLECTED: lambda t: [400, 0],
+        SENSOR_TYPE.EV3_COLOR_COLOR: lambda t: 5,
+        SENSOR_TYPE.EV3_GYRO_ABS: lambda t: 0,
+        SENSOR_TYPE.EV3_GYRO_DPS: lambda t: 0,
+        SENSOR_TYPE.EV3_GYRO_ABS_DPS: lambda t: [0, 0],
+    }
+
+    def __init__(self, transfer_time: float = TRANSFER_TIME, configure_time: float = CONFIGURE_TIME):
+        self.transfer_time = transfer_time
+        self.configure_time = configure_time
+        self.SPI_Address = 1
+        self.SensorType = [self.SENSOR_TYPE.NONE] * 4
+        self.I2CInBytes = [0] * 4
+        self._transfers = [0]  # number of SPI transfers so far
+        self._bus = Lock()
+        self._start = monotonic()
+        self._configured_at = [0.0] * 4
+        self._values: list[Callable[[float], object] | None] = [None] * 4
+        self._fault_rates = [0.0] * 4
+        self._random = Random(211)
+        self._motors = {port: {"power": 0, "dps": 0, "encoder": 0.0, "updated": monotonic()}
+                        for port in (self.PORT_A, self.PORT_B, self.PORT_C, self.PORT_D)}
+
+    # Simulation controls
+
+    @property
+    def transfers(self) -> int:
+        "Return the number of SPI transfers so far."
+        return self._transfers[0]
+
+    def sim_set_value(self, port: int, value: object | Callable[[float], object]):
+        "Make the sensor on the port return the value, or value(t) if it is a function of the time."
+        self._values[self._port_index(port)] = value if callable(value) else lambda t: value
+
+    def sim_set_fault_rate(self, port: int, rate: float):
+        "Make the given fraction (0 to 1) of reads of the sensor on the port fail with NO_DATA."
+        self._fault_rates[self._port_index(port)] = rate
+
+    def sim_reset(self):
+        "Restore default sensor values, remove faults, and stop all motors. Sensors stay configured."
+        self._values[:] = [None] * 4
+        self._fault_rates[:] = [0.0] * 4
+        self._set_motors(self.PORT_A | self.PORT_B | self.PORT_C | self.PORT_D, power=0, dps=0)
+
+    # brickpi3 API
+
+    def spi_transfer_array(self, data_out: list[int]) -> list[int]:
+        "Simulate an SPI transfer, which holds the bus for transfer_time seconds."
+        with self._bus:
+            sleep(self.transfer_time)
+            self._transfers[0] += 1
+        reply = [0] * len(data_out)
+        message_type = data_out[1] if len(data_out) > 1 else 0
+        port_index = message_type - self.BPSPI_MESSAGE_TYPE.GET_SENSOR_1
+        if 0 <= port_index < 4 and len(reply) > 5:
+            reply[3], reply[4], reply[5] = 0xA5, self.SensorType[port_index], self._status(port_index)
+            if reply[5] == self.SENSOR_STATE.VALID_DATA and len(reply) > 6:
+                self._encode(port_index, reply)
+        return reply
+
+    def set_sensor_type(self, port: int, sensor_type: int, params: int = 0):
+        "Set the type of the sensors on the given ports."
+        for port_index in range(4):
+            if port & (1 << port_index):
+                self.SensorType[port_index] = sensor_type
+                self._configured_at[port_index] = monotonic() + self.configure_time
+        self.spi_transfer_array([self.SPI_Address, self.BPSPI_MESSAGE_TYPE.SET_SENSOR_TYPE, port, sensor_type])
+
+    def get_sensor(self, port: int) -> object:
+        "Read a sensor value. Raise SensorError if the sensor has no valid data."
+        port_index = self._port_index(port)
+        reply = self.spi_transfer_array([self.SPI_Address, self.BPSPI_MESSAGE_TYPE.GET_SENSOR_1 + port_index,
+                                         0, 0, 0, 0, 0, 0, 0, 0])
+        if reply[5] != self.SENSOR_STATE.VALID_DATA:
+            raise SensorError("get_sensor error: Invalid sensor data")
+        return self._value(port_index)
+
+    def set_motor_power(self, port: int, power: int):
+        "Set the power of the motors on the given ports."
+        self._set_motors(port, power=power, dps=0 if power == self.MOTOR_FLOAT else power * 10)
+
+    def set_motor_dps(self, port: int, dps: float):
+        "Set the speed of the motors on the given ports."
+        self._set_motors(port, dps=dps)
+
+    def set_motor_position(self, port: int, position: float):
+        "Move the motors on the given ports to the position instantly."
+        self._set_motors(port, encoder=position, dps=0)
+
+    def set_motor_position_relative(self, port: int, degrees: float):
+        "Move the motors on the given ports by the given number of degrees instantly."
+        for motor in self._motors_on(port):
+            motor["encoder"] += degrees
+        self._set_motors(port, dps=0)
+
+    def set_motor_position_kp(self, port: int, kp: float = 25):
+        self._set_motors(port)
+
+    def set_motor_position_kd(self, port: int, kd: float = 70):
+        self._set_motors(port)
+
+    def set_motor_limits(self, port: int, power: float = 0, dps: float = 0):
+        self._set_motors(port)
+
+    def get_motor_status(self, port: int) -> list:
+        "Return [flags, power, encoder, dps] of the motor on the port."
+        motor = self._update_motor(port)
+        self.spi_transfer_array([self.SPI_Address, self.BPSPI_MESSAGE_TYPE.GET_MOTOR_A_STATUS, 0, 0, 0, 0])
+        return [0, motor["power"], int(motor["encoder"]), motor["dps"]]
+
+    def get_motor_encoder(self, port: int) -> int:
+        "Return the encoder position of the motor on the port in degrees."
+        motor = self._update_motor(port)
+        self.spi_transfer_array([self.SPI_Address, self.BPSPI_MESSAGE_TYPE.GET_MOTOR_A_ENCODER, 0, 0, 0, 0])
+        return int(motor["encoder"])
+
+    def offset_motor_encoder(self, port: int, position: float):
+        "Offset the encoders of the motors on the given ports."
+        for motor in self._motors_on(port):
+            motor["encoder"] -= position
+        self._set_motors(port)
+
+    def reset_motor_encoder(self, port: int):
+        "Reset the encoders of the motors on the given ports to 0."
+        self._set_motors(port, encoder=0.0)
+
+    def reset_all(self):
+        "Unconfigure all sensors and float all motors."
+        self.SensorType[:] = [self.SENSOR_TYPE.NONE] * 4
+        self._set_motors(self.PORT_A | self.PORT_B | self.PORT_C | self.PORT_D, power=0, dps=0)
+
+    # Internals
+
+    def _port_index(self, port: int) -> int:
+        "Return the index (0 to 3) of a single sensor port."
+        if port not in (self.PORT_1, self.PORT_2, self.PORT_3, self.PORT_4):
+            raise IOError("Must be one sensor port at a time. PORT_1, PORT_2, PORT_3, or PORT_4.")
+        return port.bit_length() - 1
+
+    def _status(self, port_index: int) -> int:
+        "Return the simulated state of the sensor with the given index."
+        if self.SensorType[port_index] == self.SENSOR_TYPE.NONE:
+            return self.SENSOR_STATE.NOT_CONFIGURED
+        if monotonic() < self._configured_at[port_index]:
+            return self.SENSOR_STATE.CONFIGURING
+        if self._fault_rates[port_index] and self._random.random() < self._fault_rates[port_index]:
+            return self.SENSOR_STATE.NO_DATA
+        return self.SENSOR_STATE.VALID_DATA
+
+    def _value(self, port_index: int) -> object:
+        "Return the simulated value of the sensor with the given index."
+        value = self._values[port_index] or self.DEFAULT_VALUES.get(self.SensorType[port_index], lambda t: 0)
+        return value(monotonic() - self._start)
+
+    def _encode(self, port_index: int, reply: list[int]):
+        """
+        Write the value of the sensor with the given index into the reply, like the brick: one byte
+        in 7-byte replies, 16-bit words otherwise, and ultrasonic distances in tenths.
+        """
+        value = self._value(port_index)
+        values = value if isinstance(value, (list, tuple)) else [value]
+        if self.SensorType[port_index] in (self.SENSOR_TYPE.EV3_ULTRASONIC_CM, self.SENSOR_TYPE.EV3_ULTRASONIC_INCHES):
+            values = [value * 10 for value in values]
+        if len(reply) == 7:
+            reply[6] = int(values[0]) & 0xFF
+            return
+        for index, value in enumerate(values[:(len(reply) - 6) // 2]):
+            word = round(value) & 0xFFFF
+            reply[6 + 2 * index], reply[7 + 2 * index] = word >> 8, word & 0xFF
+
+    def _motors_on(self, port: int) -> list[dict]:
+        "Return the states of the motors on the given ports, up to date."
+        return [self._update_motor(motor_port) for motor_port in self._motors if port & motor_port]
+
+    def _update_motor(self, port: int) -> dict:
+        "Integrate the motor speed into its encoder position and return its state."
+        motor = self._motors[port]
+        now = monotonic()
+        motor["encoder"] += motor["dps"] * (now - motor["updated"])
+        motor["updated"] = now
+        return motor
+
+    def _set_motors(self, port: int, **state):
+        "Update the state of the motors on the given ports with one SPI transfer."
+        for motor in self._motors_on(port):
+            motor.update(state)
+        self.spi_transfer_array([self.SPI_Address, self.BPSPI_MESSAGE_TYPE.SET_MOTOR_POWER, port, 0])
+
+
+def install(transfer_time: float = TRANSFER_TIME, configure_time: float = CONFIGURE_TIME) -> ModuleType:
+    """
+    Register a simulated brickpi3 module, so that importing utils.brick uses a simulated brick.
+    Must be called before utils.brick is imported. Return the simulated module.
+    """
+    if any(name == "utils.brick" or name.endswith(".utils.brick") for name in sys.modules):
+        if not is_installed():
+            raise RuntimeError("install() must be called before utils.brick is imported, "
+                               "which already uses the real brickpi3 module.")
+        return sys.modules["brickpi3"]  # already installed, and used by utils.brick
+    module = ModuleType("brickpi3", "Simulated brickpi3 module, see utils.simulation.")
+    module.SIMULATED = True
+
+    class BrickPi3(SimBrickPi3):
+        "Simulated BrickPi3 with the transfer and configure times given to install()."
+
+        def __init__(self):
+            super().__init__(transfer_time, configure_time)
+
+    module.BrickPi3, module.SensorError, module.Enumeration = BrickPi3, SensorError, Enumeration
+    module.__all__ = ["BrickPi3", "SensorError", "Enumeration"]
+    sys.modules["brickpi3"] = module
+    return module
+
+
+def is_installed() -> bool:
+    "Return True if the simulated brickpi3 module is installed, so utils.brick uses a simulated brick."
+    return getattr(sys.modules.get("brickpi3"), "SIMULATED", False)
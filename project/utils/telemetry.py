@@ -0,0 +1,163 @@
+"""
+Module that streams timestamped sensor samples from the brick to a computer over UDP, using a
+compact binary format. Run telemetry_viewer.py on the computer to plot them live.
+
+Sending never blocks: samples are packed into a preallocated buffer and sent in batches from a
+background thread, and batches that cannot be sent right away are dropped (and counted) instead
+of slowing down the code that takes the samples.
+
+Packet format (little endian): a HEADER followed by `count` entries, where entries are
+SAMPLE structs for SAMPLES packets, and (channel, name length, UTF-8 name) for NAMES packets.
+"""
+
+from __future__ import annotations  # not required in Python 3.10+
+from threading import Lock, Thread
+from time import sleep, time
+import os
+import socket
+import struct
+
+
+TELEMETRY_PORT = 2110  # UDP port the viewer listens on
+MAX_PACKET_SIZE = 1400  # bytes, fits in one Ethernet/WiFi frame
+
+MAGIC = b"BT"
+SAMPLES, NAMES = 0, 1  # packet kinds
+HEADER = struct.Struct("<2sBH")  # magic, kind, count
+SAMPLE = struct.Struct("<dBBf")  # timestamp (s since epoch), channel, index in value list, value
+NAME = struct.Struct("<BB")  # channel, name length
+
+# NumPy dtype of SAMPLE, so that receivers can decode a whole packet at once with numpy.frombuffer
+SAMPLE_DTYPE = [("time", "<f8"), ("channel", "u1"), ("index", "u1"), ("value", "<f4")]
+SAMPLES_PER_PACKET = (MAX_PACKET_SIZE - HEADER.size) // SAMPLE.size
+
+
+def default_host() -> str:
+    """
+    Return the address of the computer to send telemetry to: the TELEMETRY_HOST environment
+    variable if set, otherwise the computer that started this program over SSH, otherwise localhost.
+    """
+    if "TELEMETRY_HOST" in os.environ:
+        return os.environ["TELEMETRY_HOST"]
+    if "SSH_CLIENT" in os.environ:  # "<client ip> <client port> <server port>"
+        return os.environ["SSH_CLIENT"].split()[0]
+    return "127.0.0.1"
+
+
+class TelemetrySender:
+    """
+    Send samples to a telemetry viewer. Safe to use from several sampling threads at once.
+
+    Example:
+
+    telemetry = TelemetrySender()
+    channel = telemetry.add_channel("EV3ColorSensor")
+    while True:
+        telemetry.record(channel, color_sensor.get_value())
+    """
+
+    def __init__(self, host: str = None, port: int = TELEMETRY_PORT, flush_interval: float = 0.05):
+        """
+        Send to the given host and port, or to default_host() if no host is given.
+        Pending samples are sent at least every flush_interval seconds.
+        """
+        self.address = (host or default_host(), port)
+        self.flush_interval = flush_interval
+        self.sent = self.dropped = 0  # number of samples
+        self.channels: dict[str, int] = {}
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setblocking(False)
+        self._buffer = bytearray(MAX_PACKET_SIZE)
+        self._count = 0
+        self._lock = Lock()
+        Thread(target=self._flush_periodically, daemon=True).start()
+
+    def add_channel(self, name: str) -> int:
+        "Return the channel number for the given name, allocating a new one if needed."
+        with self._lock:
+            if name not in self.channels:
+                if len(self.channels) == 256:
+                    raise ValueError("Too many telemetry channels, the maximum is 256.")
+                self.channels[name] = len(self.channels)
+            return self.channels[name]
+
+    def record(self, channel: int, value: float | list[float] | None, timestamp: float = None):
+        """
+        Record a sample on the given channel. A list of values is recorded as one sample per item,
+        and None (a failed read) is ignored. The timestamp defaults to the current time.
+        """
+        if value is None:
+            return
+        if timestamp is None:
+            timestamp = time()
+        values = value if isinstance(value, (list, tuple)) else (value,)
+        with self._lock:
+            for index, item in enumerate(values):
+                if self._count == SAMPLES_PER_PACKET:
+                    self._send()
+                SAMPLE.pack_into(self._buffer, HEADER.size + self._count * SAMPLE.size,
+                                 timestamp, channel, index, item)
+                self._count += 1
+
+    def flush(self):
+        "Send all pending samples now."
+        with self._lock:
+            self._send()
+
+    def _send(self):
+        "Send the pending samples. The lock must be held."
+        if not self._count:
+            return
+        HEADER.pack_into(self._buffer, 0, MAGIC, SAMPLES, self._count)
+        size = HEADER.size + self._count * SAMPLE.size
+        if self._send_packet(memoryview(self._buffer)[:size]):
+            self.sent += self._count
+        else:
+            self.dropped += self._count
+        self._count = 0
+
+    def _send_packet(self, packet: bytes) -> bool:
+        "Try to send the packet without blocking. Return True if it was sent."
+        try:
+            self._socket.sendto(packet, self.address)
+            return True
+        except OSError:  # socket buffer full, no network, or nobody listening
+            return False
+
+    def _names_packet(self) -> bytes:
+        "Return a packet mapping channel numbers to names."
+        with self._lock:
+            channels = list(self.channels.items())
+        packet = bytearray(HEADER.pack(MAGIC, NAMES, len(channels)))
+        for name, channel in channels:
+            encoded = name.encode()[:255]
+            packet += NAME.pack(channel, len(encoded)) + encoded
+        return bytes(packet)
+
+    def _flush_periodically(self):
+        "Send pending samples every flush interval and channel names every second, forever."
+        last_names = 0
+        while True:
+            sleep(self.flush_interval)
+            self.flush()
+            if time() - last_names >= 1:  # resend regularly, so that a viewer can be started at any time
+                self._send_packet(self._names_packet())
+                last_names = time()
+
+
+def decode_names(packet: bytes) -> dict[int, str]:
+    "Return the channel names contained in a NAMES packet."
+    _, _, count = HEADER.unpack_from(packet)
+    names, offset = {}, HEADER.size
+    for _ in range(count):
+        channel, length = NAME.unpack_from(packet, offset)
+        offset += NAME.size
+        names[channel] = packet[offset:offset + length].decode(errors="replace")
+        offset += length
+    return names
+
+
+def decode_samples(packet: bytes) -> list[tuple[float, int, int, float]]:
+    "Return the (timestamp, channel, index, value) samples contained in a SAMPLES packet."
+    _, _, count = HEADER.unpack_from(packet)
+    return list(SAMPLE.iter_unpack(packet[HEADER.size:HEADER.size + count * SAMPLE.size]))
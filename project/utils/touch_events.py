@@ -0,0 +1,182 @@
+"""
+Module that turns touch sensor polling into press, release, and long-press events.
+
+Instead of every part of the program spinning on TouchSensor.is_pressed(), one shared poller
+thread samples all touch sensors at a fixed rate, debounces them, and dispatches timestamped
+events to callbacks or to a queue. Code waiting for a button blocks on the queue (or just
+registers a callback) and uses no CPU while idle.
+
+Example:
+
+poller = shared_poller()
+poller.add(TOUCH_SENSOR, on_press=lambda event: print("Pressed!"))
+
+or, to wait for the next event:
+
+events = Queue()
+poller.add(TOUCH_SENSOR, queue=events)
+event = events.get()  # blocks until the button is pressed or released
+"""
+
+from __future__ import annotations  # not required in Python 3.10+
+from queue import Queue
+from threading import Event, Lock, Thread
+from time import monotonic
+from traceback import print_exc
+from typing import Callable
+
+from .brick import Sensor, SensorReading, TouchSensor
+from .shutdown import SHUTDOWN
+
+
+POLL_RATE = 100  # Hz
+DEBOUNCE_TIME = 0.02  # seconds a new state must last to be accepted
+LONG_PRESS_TIME = 1.0  # seconds
+
+
+class TouchEvent:
+    "A debounced change of a touch sensor."
+    PRESS = "press"
+    RELEASE = "release"
+    LONG_PRESS = "long_press"
+    __slots__ = ("sensor", "kind", "timestamp", "duration")
+
+    def __init__(self, sensor: TouchSensor, kind: str, timestamp: float, duration: float = 0.0):
+        self.sensor = sensor
+        self.kind = kind
+        self.timestamp = timestamp  # monotonic time of the first sample in the new state
+        self.duration = duration  # for releases and long presses, how long the button was held
+
+    def __repr__(self):
+        return f"TouchEvent({self.kind}, port {self.sensor.port}, t={self.timestamp:.3f}, held {self.duration:.3f} s)"
+
+
+class _TouchState:
+    "Debouncing state and listeners of one touch sensor."
+    __slots__ = ("sensor", "reading", "listeners", "queues", "pressed", "pressed_since", "candidate",
+                 "candidate_since", "long_press_sent")
+
+    def __init__(self, sensor: TouchSensor):
+        self.sensor = sensor
+        self.reading = SensorReading()  # own result slot, so the program can still read the sensor itself
+        self.listeners: dict[str, list[Callable[[TouchEvent], None]]] = {
+            TouchEvent.PRESS: [], TouchEvent.RELEASE: [], TouchEvent.LONG_PRESS: []}
+        self.queues: list[Queue] = []
+        self.pressed = False  # debounced state
+        self.pressed_since = 0.0  # monotonic time the debounced state last changed
+        self.candidate = False  # latest raw state
+        self.candidate_since = 0.0  # monotonic time of the first sample in the latest raw state
+        self.long_press_sent = False
+
+
+class TouchPoller:
+    "Thread that polls touch sensors and dispatches their debounced events."
+
+    def __init__(self, rate: float = POLL_RATE, debounce: float = DEBOUNCE_TIME,
+                 long_press: float = LONG_PRESS_TIME):
+        self.period = 1 / rate
+        self.debounce = debounce
+        self.long_press = long_press
+        self.states: list[_TouchState] = []
+        self._lock = Lock()
+        self._stop = Event()
+        self._thread: Thread | None = None
+
+    def add(self, sensor: TouchSensor, on_press: Callable[[TouchEvent], None] = None,
+            on_release: Callable[[TouchEvent], None] = None, on_long_press: Callable[[TouchEvent], None] = None,
+            queue: Queue = None):
+        """
+        Listen to the events of the sensor, with callbacks and/or a queue that receives every event.
+        Callbacks run on the poller thread, so they should return quickly. Starts the poller if needed.
+        """
+        with self._lock:
+            state = next((state for state in self.states if state.sensor is sensor), None)
+            if state is None:
+                state = _TouchState(sensor)
+                self.states = self.states + [state]  # replaced, not changed, so the poller can iterate freely
+            for kind, callback in ((TouchEvent.PRESS, on_press), (TouchEvent.RELEASE, on_release),
+                                   (TouchEvent.LONG_PRESS, on_long_press)):
+                if callback:
+                    state.listeners[kind].append(callback)
+            if queue is not None:
+                state.queues.append(queue)
+        self.start()
+
+    def remove(self, sensor: TouchSensor):
+        "Stop listening to the events of the sensor."
+        with self._lock:
+            self.states = [state for state in self.states if state.sensor is not sensor]
+
+    def start(self):
+        "Start polling in the background, if not already started."
+        with self._lock:
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = Thread(target=self._poll, name="touch-poller", daemon=True)
+                SHUTDOWN.register_thread(self._thread, self._stop.set)
+                self._thread.start()
+
+    def stop(self, timeout: float = None):
+        "Stop polling and wait for the poller thread to finish."
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            thread.join(timeout)
+
+    def _poll(self):
+        "Sample every sensor once per period until stopped."
+        next_poll = monotonic()
+        while not self._stop.is_set():
+            for state in self.states:
+                self._update(state)
+            next_poll += self.period
+            delay = next_poll - monotonic()
+            if delay < 0:  # running late, skip the missed polls
+                next_poll, delay = monotonic(), 0
+            self._stop.wait(delay)
+
+    def _update(self, state: _TouchState):
+        "Sample one sensor and dispatch the events its new sample causes."
+        status, value = state.sensor.read(state.reading)
+        now = monotonic()
+        if status != Sensor.Status.VALID_DATA:
+            return  # keep the current state until the sensor answers again
+        raw = value > 0
+        if raw != state.candidate:
+            state.candidate, state.candidate_since = raw, now
+        elif raw != state.pressed and now - state.candidate_since >= self.debounce:
+            state.pressed = raw
+            if raw:
+                state.long_press_sent = False
+                self._dispatch(state, TouchEvent(state.sensor, TouchEvent.PRESS, state.candidate_since))
+            else:
+                self._dispatch(state, TouchEvent(state.sensor, TouchEvent.RELEASE, state.candidate_since,
+                                                 state.candidate_since - state.pressed_since))
+            state.pressed_since = state.candidate_since
+        if state.pressed and not state.long_press_sent and now - state.pressed_since >= self.long_press:
+            state.long_press_sent = True
+            self._dispatch(state, TouchEvent(state.sensor, TouchEvent.LONG_PRESS, now, now - state.pressed_since))
+
+    def _dispatch(self, state: _TouchState, event: TouchEvent):
+        "Send the event to the callbacks and queues of its sensor."
+        for callback in state.listeners[event.kind]:
+            try:
+                callback(event)
+            except Exception:  # keep polling the other sensors
+                print_exc()
+        for queue in state.queues:
+            queue.put(event)
+
+
+_shared_poller: TouchPoller | None = None
+_shared_poller_lock = Lock()
+
+
+def shared_poller() -> TouchPoller:
+    "Return the poller shared by the whole program, creating it with the default settings if needed."
+    global _shared_poller
+    with _shared_poller_lock:
+        if _shared_poller is None:
+            _shared_poller = TouchPoller()
+        return _shared_poller
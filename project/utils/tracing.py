@@ -0,0 +1,190 @@
+"""
+Module that records a timeline of what every thread does with the BrickPi: SPI bus transfers,
+sensor reads, mode switches, and sleeps, including utils.shutdown.sleep(). The timeline is exported in the Chrome trace event
+format, which can be opened at https://ui.perfetto.dev or chrome://tracing to see how the
+threads interleave and where they wait.
+
+Tracing is opt-in. enable() wraps the traced functions and disable() puts the originals back.
+Set the BRICK_TRACE environment variable to a file path to trace a whole run and export the
+trace to that file when the program exits, without changing any code:
+
+BRICK_TRACE=~/trace.json python3 project/threadexample.py
+
+Each thread appends to its own event list, so recording an event never takes a lock.
+"""
+
+from __future__ import annotations  # not required in Python 3.10+
+from threading import Lock, current_thread, get_native_id, local
+from time import perf_counter_ns
+from types import FunctionType
+import json
+import os
+import sys
+import time
+
+from . import patching
+
+
+TRACE_FILE = "~/brickpi3_trace.json"  # on the brick
+MAX_EVENTS_PER_THREAD = 1_000_000  # about 100 MB, later events are dropped
+
+
+class ThreadBuffer:
+    "Events recorded by one thread, as (name, category, start ns, duration ns, args) tuples."
+    __slots__ = ("tid", "name", "events", "dropped")
+
+    def __init__(self):
+        thread = current_thread()
+        self.tid = get_native_id()
+        self.name = thread.name
+        self.events: list[tuple[str, str, int, int, dict | None]] = []
+        self.dropped = 0
+
+
+_local = local()
+_buffers: list[ThreadBuffer] = []  # only changed when a thread records its first event
+_buffers_lock = Lock()
+_start_ns = perf_counter_ns()
+_enabled = False
+
+
+def _buffer() -> ThreadBuffer:
+    "Return the event buffer of the calling thread, creating it on first use."
+    try:
+        return _local.buffer
+    except AttributeError:
+        _local.buffer = buffer = ThreadBuffer()
+        with _buffers_lock:
+            _buffers.append(buffer)
+        return buffer
+
+
+def record(name: str, category: str, start_ns: int, duration_ns: int, args: dict = None):
+    "Record an event of the calling thread that started at the given perf_counter_ns() time."
+    buffer = _buffer()
+    if len(buffer.events) < MAX_EVENTS_PER_THREAD:
+        buffer.events.append((name, category, start_ns, duration_ns, args))
+    else:
+        buffer.dropped += 1
+
+
+def traced(name: str, category: str, function: FunctionType, args_of: FunctionType = None) -> FunctionType:
+    """
+    Return a wrapper of the function that records each call as an event with the given name and
+    category. args_of(args) may return a dictionary of details to attach to the event, eg the port.
+    """
+    def wrapper(*args, **kwargs):
+        start = perf_counter_ns()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            record(name, category, start, perf_counter_ns() - start, args_of(args) if args_of else None)
+    wrapper.__name__, wrapper.__doc__, wrapper.__wrapped__ = function.__name__, function.__doc__, function
+    return wrapper
+
+
+class span:
+    """
+    Context manager that records the enclosed code as an event, to trace application code:
+
+    with span("compute path", "app"):
+        ...
+    """
+    __slots__ = ("name", "category", "args", "start")
+
+    def __init__(self, name: str, category: str = "app", **args):
+        self.name, self.category, self.args = name, category, args or None
+
+    def __enter__(self):
+        self.start = perf_counter_ns()
+        return self
+
+    def __exit__(self, *_exc):
+        record(self.name, self.category, self.start, perf_counter_ns() - self.start, self.args)
+
+
+def _patch(owner: object, attribute: str, wrap: FunctionType):
+    "Wrap an attribute of a class or module with wrap(function), which disable() removes, see utils.patching."
+    patching.patch("tracing", owner, attribute, wrap)
+
+
+def is_enabled() -> bool:
+    "Return True if tracing is enabled."
+    return _enabled
+
+
+def enable():
+    "Start tracing the bus transfers, sensor operations, and sleeps. Does nothing if already enabled."
+    global _enabled
+    if _enabled:
+        return
+    from . import brick  # imported here since importing utils.brick connects to the BrickPi
+
+    message_types = {value: name for name, value in brick.BrickPi3.BPSPI_MESSAGE_TYPE.__dict__.items()
+                     if name.isupper()}
+    port_names = {brick.PORTS[name]: name for name in "1234"}
+    spi_args = lambda args: {"message": message_types.get(args[1][1], args[1][1])}
+    brick_port = lambda args: {"port": port_names.get(args[1], args[1])}
+    sensor_port = lambda args: {"port": port_names.get(args[0].port, args[0].port),
+                                "mode": args[1] if len(args) > 1 else None}
+
+    _patch(brick.BrickPi3, "spi_transfer_array", lambda function: traced("spi_transfer", "bus", function, spi_args))
+    _patch(brick.Brick, "get_sensor_status",
+           lambda function: traced("get_sensor_status", "sensor", function, brick_port))
+    _patch(brick.Brick, "get_sensor", lambda function: traced("get_sensor", "sensor", function, brick_port))
+    _patch(brick.Brick, "read_sensor", lambda function: traced("read_sensor", "sensor", function, brick_port))
+    _patch(brick.Sensor, "wait_ready", lambda function: traced(
+        "wait_ready", "sensor", function, lambda args: {"port": port_names.get(args[0].port)}))
+    for sensor_class in brick.Sensor.__subclasses__():
+        if "set_mode" in sensor_class.__dict__:
+            _patch(sensor_class, "set_mode", lambda function: traced("set_mode", "mode", function, sensor_port))
+
+    # Modules that did `from time import sleep` or `from utils.shutdown import sleep` have their own
+    # reference to the original function
+    from . import shutdown
+    original_sleeps = (time.sleep, shutdown.sleep)
+    sleep_args = lambda args: {"seconds": args[0]}
+    for module in list(sys.modules.values()):
+        if module is not None and getattr(module, "sleep", None) in original_sleeps:
+            _patch(module, "sleep", lambda function: traced("sleep", "sleep", function, sleep_args))
+    _enabled = True
+
+
+def disable():
+    "Stop tracing and restore the original functions. The events recorded so far are kept."
+    global _enabled
+    patching.unpatch("tracing")
+    _enabled = False
+
+
+def reset():
+    "Forget all events recorded so far."
+    with _buffers_lock:
+        for buffer in _buffers:
+            buffer.events.clear()
+            buffer.dropped = 0
+
+
+def chrome_trace() -> dict:
+    "Return the recorded events in the Chrome trace event format, with times in microseconds."
+    pid = os.getpid()
+    trace_events = [{"name": "process_name", "ph": "M", "pid": pid, "args": {"name": "BrickPi program"}}]
+    with _buffers_lock:
+        buffers = list(_buffers)
+    for buffer in buffers:
+        name = f"{buffer.name} ({buffer.dropped} events dropped)" if buffer.dropped else buffer.name
+        trace_events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": buffer.tid,
+                             "args": {"name": name}})
+        for name, category, start_ns, duration_ns, args in list(buffer.events):
+            event = {"name": name, "cat": category, "ph": "X", "pid": pid, "tid": buffer.tid,
+                     "ts": (start_ns - _start_ns) / 1000, "dur": duration_ns / 1000}
+            if args:
+                event["args"] = args
+            trace_events.append(event)
+    return {"traceEvents": trace_events, "displayTimeUnit": "ms"}
+
+
+def export_chrome_trace(path: str = TRACE_FILE):
+    "Write the recorded events to a JSON file that can be opened in Perfetto or chrome://tracing."
+    with open(os.path.expanduser(path), "w") as f:
+        json.dump(chrome_trace(), f)
@@ -0,0 +1,177 @@
+"""
+Module that notices when a loop stops running, eg a sampler thread stuck in an SPI transfer or in a
+wait_ready() that never sees VALID_DATA, instead of letting the robot act on stale data.
+
+Each loop registers with its expected period and records a heartbeat every iteration. Heartbeats
+are written into a preallocated array, one slot per loop, so recording one costs a clock read and
+a store. A single monitor thread checks every slot, and when a loop misses its deadline (no
+heartbeat for period * tolerance seconds), it counts the miss and calls the alert callbacks, once
+per stall.
+
+Example:
+
+with shared_watchdog().register("US sampler", period=0.01) as heartbeat:
+    while True:
+        heartbeat.beat()
+        US_SENSOR.read(READING)
+        sleep(0.01)
+
+Other threads can then check heartbeat.stalled, or use READING.fresh(max_age), which returns a
+STALE status instead of an old value.
+"""
+
+from __future__ import annotations  # not required in Python 3.10+
+from array import array
+from threading import Event, Lock, Thread
+from time import monotonic
+from traceback import print_exc
+from typing import Callable
+
+from .shutdown import SHUTDOWN
+
+
+MAX_LOOPS = 32  # slots in the heartbeat array
+TOLERANCE = 3.0  # periods a loop can go without a heartbeat before it misses its deadline
+CHECK_INTERVAL = 0.02  # seconds between checks of the monitor thread
+
+
+class Heartbeat:
+    "Handle of a loop registered with a watchdog. Use as a context manager to unregister at the end."
+    __slots__ = ("watchdog", "name", "slot", "deadline", "_beats")
+
+    def __init__(self, watchdog: Watchdog, name: str, slot: int, deadline: float):
+        self.watchdog = watchdog
+        self.name = name
+        self.slot = slot
+        self.deadline = deadline  # seconds without a heartbeat that count as a miss
+        self._beats = watchdog.beats
+
+    def beat(self):
+        "Record that the loop is still running. Call once per iteration."
+        self._beats[self.slot] = monotonic()
+
+    @property
+    def age(self) -> float:
+        "Return the number of seconds since the last heartbeat."
+        return monotonic() - self._beats[self.slot]
+
+    @property
+    def stalled(self) -> bool:
+        "Return True if the loop has missed its deadline."
+        return self.age > self.deadline
+
+    def __enter__(self) -> Heartbeat:
+        return self
+
+    def __exit__(self, *args):
+        self.watchdog.unregister(self)
+
+
+class Watchdog:
+    "Monitor thread that checks the heartbeats of registered loops against their expected periods."
+
+    def __init__(self, capacity: int = MAX_LOOPS, interval: float = CHECK_INTERVAL):
+        self.interval = interval
+        self.beats = array("d", [0.0] * capacity)  # monotonic time of the last heartbeat of each slot
+        self.deadlines = array("d", [0.0] * capacity)
+        self.stalled = array("b", [0] * capacity)  # 1 while the loop of the slot is stalled
+        self.names: list[str | None] = [None] * capacity  # None for free slots
+        self.misses: dict[str, int] = {}  # number of missed deadlines of each loop, kept after unregistering
+        self.alerts: list[Callable[[str, float], None]] = []
+        self._lock = Lock()
+        self._stop = Event()
+        self._thread: Thread | None = None
+
+    def register(self, name: str, period: float, tolerance: float = TOLERANCE) -> Heartbeat:
+        """
+        Register a loop that records a heartbeat every period seconds, and start monitoring if needed.
+        The loop misses its deadline after period * tolerance seconds without a heartbeat.
+        """
+        with self._lock:
+            if None not in self.names:
+                raise RuntimeError(f"Cannot watch more than {len(self.names)} loops.")
+            slot = self.names.index(None)
+            self.beats[slot] = monotonic()
+            self.deadlines[slot] = period * tolerance
+            self.stalled[slot] = 0
+            self.names[slot] = name
+            self.misses.setdefault(name, 0)
+        self.start()
+        return Heartbeat(self, name, slot, period * tolerance)
+
+    def unregister(self, heartbeat: Heartbeat):
+        "Stop watching the loop of the heartbeat, eg when it ends normally."
+        with self._lock:
+            self.names[heartbeat.slot] = None
+
+    def add_alert(self, callback: Callable[[str, float], None]):
+        "Call callback(name, seconds since last heartbeat) on the monitor thread when a loop misses its deadline."
+        self.alerts.append(callback)
+
+    def start(self):
+        "Start monitoring in the background, if not already started."
+        with self._lock:
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = Thread(target=self._monitor, name="watchdog", daemon=True)
+                SHUTDOWN.register_thread(self._thread, self._stop.set)
+                self._thread.start()
+
+    def stop(self, timeout: float = None):
+        "Stop monitoring and wait for the monitor thread to finish."
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            thread.join(timeout)
+
+    def check(self, now: float = None):
+        "Check every loop once, counting and alerting new misses. Called periodically by the monitor thread."
+        now = monotonic() if now is None else now
+        for slot, name in enumerate(self.names):
+            if name is None:
+                continue
+            age = now - self.beats[slot]
+            if age <= self.deadlines[slot]:
+                self.stalled[slot] = 0  # running, or running again
+            elif not self.stalled[slot]:  # alert once per stall
+                self.stalled[slot] = 1
+                self.misses[name] += 1
+                for callback in self.alerts:
+                    try:
+                        callback(name, age)
+                    except Exception:  # keep monitoring the other loops
+                        print_exc()
+
+    def snapshot(self) -> dict[str, dict]:
+        "Return {name: {'misses': int, 'stalled': bool, 'age_s': float}} for every loop seen so far."
+        now = monotonic()
+        loops = {name: {"misses": misses, "stalled": False, "age_s": None} for name, misses in self.misses.items()}
+        for slot, name in enumerate(self.names):
+            if name is not None:
+                loops[name].update(stalled=bool(self.stalled[slot]), age_s=round(now - self.beats[slot], 6))
+        return loops
+
+    def _monitor(self):
+        "Check the loops every interval until stopped."
+        while not self._stop.wait(self.interval):
+            self.check()
+
+
+def print_alert(name: str, age: float):
+    "Alert callback that prints the loop that missed its deadline, in red."
+    print(f"\033[91mWatchdog: {name} has not run for {age * 1000:.0f} ms\033[0m")
+
+
+_shared_watchdog: Watchdog | None = None
+_shared_watchdog_lock = Lock()
+
+
+def shared_watchdog() -> Watchdog:
+    "Return the watchdog shared by the whole program, which prints its alerts, creating it if needed."
+    global _shared_watchdog
+    with _shared_watchdog_lock:
+        if _shared_watchdog is None:
+            _shared_watchdog = Watchdog()
+            _shared_watchdog.add_alert(print_alert)
+        return _shared_watchdog
@@ -1,11 +1,17 @@
 #!/usr/bin/env python3
 
 """
-Script to reset brick.
+Script to reset brick. If a program using utils.brick is running, it is asked to stop through its
+control socket, which takes milliseconds. Otherwise, or if it does not exit in time, eg because it
+is stuck in an SPI transfer, the brick is reset directly and the program is interrupted.
 """
 
 import brickpi3
 import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "project"))
+from utils.control import stop_program
 
 def is_raspberry_pi() -> bool:
     "Return True if script is run on Raspberry Pi, False otherwise."
@@ -19,6 +25,9 @@ def is_raspberry_pi() -> bool:
 
 def reset_brick():
     "Reset the brick hardware."
+    if stop_program():  # the program stopped its motors and reset the brick itself
+        print("Stopped the running program.")
+        return
     brickpi3.BrickPi3().reset_all()
     os.system("kill -INT `cat ~/brickpi3_pid`")
 
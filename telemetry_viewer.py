@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+
+"""
+Script to plot the telemetry sent by the robot live, on this computer. See
+project/utils/telemetry.py for how to send telemetry from the robot.
+
+Usage: python3 telemetry_viewer.py [-port PORT] [-window SECONDS] [-record FILE.csv]
+
+Samples are received on a background thread and kept in fixed-size ring buffers. Each plot
+update only draws a min-max decimated copy of the visible window, so the viewer keeps up with
+kHz sample rates. With -record, every sample is also written to a CSV file, which
+analyze_samples.py turns into rate, jitter, gap, and skew statistics after the run.
+"""
+
+from __future__ import annotations  # not required in Python 3.10+
+from argparse import ArgumentParser
+from threading import Lock, Thread
+from time import time
+import csv
+import socket
+
+from matplotlib import pyplot as plt
+from matplotlib.animation import FuncAnimation
+import numpy as np
+
+from project.utils.telemetry import (HEADER, MAGIC, MAX_PACKET_SIZE, NAMES, SAMPLE_DTYPE, SAMPLES,
+                                     TELEMETRY_PORT, decode_names)
+
+
+SAMPLE = np.dtype(SAMPLE_DTYPE)
+CAPACITY = 2 ** 18  # samples kept per series, about 4 minutes at 1 kHz
+MAX_POINTS = 2000  # points drawn per series after decimation
+UPDATE_MS = 50  # delay between plot updates in milliseconds
+
+
+class Series:
+    "Ring buffer of the most recent (time, value) samples of one value of one channel."
+
+    def __init__(self, capacity: int = CAPACITY):
+        self.times = np.zeros(capacity)
+        self.values = np.zeros(capacity, dtype=np.float32)
+        self.count = 0  # total number of samples ever added
+
+    def extend(self, times: np.ndarray, values: np.ndarray):
+        "Add samples, overwriting the oldest ones when full."
+        capacity = len(self.times)
+        times, values = times[-capacity:], values[-capacity:]
+        indices = (self.count + np.arange(len(times))) % capacity
+        self.times[indices] = times
+        self.values[indices] = values
+        self.count += len(times)
+
+    def since(self, start: float) -> tuple[np.ndarray, np.ndarray]:
+        "Return the samples taken at or after the start time, oldest first."
+        capacity = len(self.times)
+        if self.count <= capacity:
+            times, values = self.times[:self.count], self.values[:self.count]
+        else:
+            split = self.count % capacity
+            times = np.concatenate((self.times[split:], self.times[:split]))
+            values = np.concatenate((self.values[split:], self.values[:split]))
+        first = np.searchsorted(times, start)  # samples of one series arrive in time order
+        return times[first:], values[first:]
+
+
+def minmax_decimate(times: np.ndarray, values: np.ndarray, bins: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Reduce the samples to at most 2 * bins points by keeping only the minimum and maximum of each
+    bin, in time order. Unlike taking every nth sample, this keeps every spike visible.
+    """
+    if len(values) <= 2 * bins:
+        return times, values
+    size = len(values) // bins
+    used = size * bins  # drop the oldest samples that do not fill a whole bin
+    times = times[-used:].reshape(bins, size)
+    values = values[-used:].reshape(bins, size)
+    lows, highs = values.argmin(axis=1), values.argmax(axis=1)
+    columns = np.stack((np.minimum(lows, highs), np.maximum(lows, highs)), axis=1)
+    rows = np.arange(bins)[:, None]
+    return times[rows, columns].ravel(), values[rows, columns].ravel()
+
+
+class SampleRecorder:
+    """
+    Writes every received sample to a CSV file with the columns time (on the robot), received (on
+    this computer), sensor, index, and value. Samples of channels whose name has not been received
+    yet are kept until it is, so that every row has the sensor name.
+    """
+
+    def __init__(self, path: str):
+        self.file = open(path, "w", newline="")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(("time", "received", "sensor", "index", "value"))
+        self.pending: list[tuple[np.ndarray, float]] = []  # (samples, receive time) of packets not written yet
+        self.lock = Lock()
+
+    def write(self, samples: np.ndarray, received: float, names: dict[int, str]):
+        "Write the samples of a packet, once the names of all their channels are known."
+        with self.lock:
+            if self.file.closed:
+                return
+            self.pending.append((samples, received))
+            if all(channel in names for samples, _ in self.pending for channel in np.unique(samples["channel"])):
+                self.flush(names)
+
+    def flush(self, names: dict[int, str]):
+        "Write the pending samples, naming unknown channels by number."
+        for samples, received in self.pending:
+            sensors = [names.get(channel, f"channel {channel}") for channel in samples["channel"].tolist()]
+            self.writer.writerows(zip(samples["time"].tolist(), [received] * len(samples), sensors,
+                                      samples["index"].tolist(), samples["value"].tolist()))
+        self.pending.clear()
+
+    def close(self, names: dict[int, str]):
+        "Write the pending samples and close the file."
+        with self.lock:
+            self.flush(names)
+            self.file.close()
+
+
+class TelemetryReceiver:
+    "Receive telemetry packets on a background thread and store their samples."
+
+    def __init__(self, port: int = TELEMETRY_PORT, recorder: SampleRecorder = None):
+        self.names: dict[int, str] = {}
+        self.series: dict[tuple[int, int], Series] = {}  # by (channel, index)
+        self.recorder = recorder
+        self.lock = Lock()
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(("", port))
+        Thread(target=self.receive_forever, daemon=True).start()
+
+    def receive_forever(self):
+        "Receive and store packets until the program exits."
+        while True:
+            packet = self.socket.recv(MAX_PACKET_SIZE)
+            if len(packet) < HEADER.size:
+                continue
+            magic, kind, count = HEADER.unpack_from(packet)
+            if magic != MAGIC:
+                continue
+            if kind == NAMES:
+                with self.lock:
+                    self.names.update(decode_names(packet))
+            elif kind == SAMPLES:
+                samples = np.frombuffer(packet, dtype=SAMPLE, count=count, offset=HEADER.size)
+                self.store(samples)
+                if self.recorder:
+                    self.recorder.write(samples, time(), self.names)
+
+    def store(self, samples: np.ndarray):
+        "Add decoded samples to their series."
+        keys = samples["channel"].astype(np.uint16) << 8 | samples["index"]
+        with self.lock:
+            for key in np.unique(keys):
+                selected = samples[keys == key]
+                series_key = (int(key) >> 8, int(key) & 0xFF)
+                if series_key not in self.series:
+                    self.series[series_key] = Series()
+                self.series[series_key].extend(selected["time"], selected["value"])
+
+
+class TelemetryPlot:
+    "Live plot with one subplot per channel and one line per value of the channel."
+
+    def __init__(self, receiver: TelemetryReceiver, window: float):
+        self.receiver = receiver
+        self.window = window
+        self.figure = plt.figure("Robot telemetry")
+        self.channels: list[int] = []
+        self.axes: dict[int, plt.Axes] = {}
+        self.lines: dict[tuple[int, int], plt.Line2D] = {}
+
+    def layout(self, channels: list[int]):
+        "Recreate the subplots when new channels appear."
+        self.figure.clear()
+        self.channels = channels
+        self.axes = {channel: self.figure.add_subplot(len(channels), 1, n)
+                     for n, channel in enumerate(channels, 1)}
+        self.lines = {}
+
+    def update(self, _frame=None):
+        "Redraw the visible window of every series."
+        with self.receiver.lock:  # copy the visible samples, so the receiver is not blocked while drawing
+            names = dict(self.receiver.names)
+            if not self.receiver.series:
+                return
+            now = max(s.times[(s.count - 1) % len(s.times)] for s in self.receiver.series.values())
+            visible = {key: s.since(now - self.window) for key, s in self.receiver.series.items()}
+        channels = sorted({channel for channel, _ in visible})
+        if channels != self.channels:
+            self.layout(channels)
+        rates = dict.fromkeys(self.channels, 0.0)
+        for (channel, index), (times, values) in visible.items():
+            if index == 0:
+                rates[channel] = len(times) / self.window
+            times, values = minmax_decimate(times, values, MAX_POINTS // 2)
+            if (channel, index) not in self.lines:
+                self.lines[(channel, index)], = self.axes[channel].plot([], [], label=f"[{index}]")
+            self.lines[(channel, index)].set_data(times - now, values)
+        for channel, axes in self.axes.items():
+            axes.set_title(f"{names.get(channel, f'Channel {channel}')} ({rates[channel]:.0f} Hz)", fontsize="small")
+            axes.set_xlim(-self.window, 0)
+            axes.relim()
+            axes.autoscale_view(scalex=False)
+        self.figure.tight_layout()
+
+
+if __name__ == "__main__":
+    "Main entry point."
+    parser = ArgumentParser(description="Plot robot telemetry live.")
+    parser.add_argument("-port", type=int, default=TELEMETRY_PORT, help="UDP port to listen on")
+    parser.add_argument("-window", type=float, default=10, help="number of seconds shown")
+    parser.add_argument("-record", help="also write every sample to this CSV file, see analyze_samples.py")
+    args = parser.parse_args()
+
+    recorder = SampleRecorder(args.record) if args.record else None
+    receiver = TelemetryReceiver(args.port, recorder)
+    plot = TelemetryPlot(receiver, args.window)
+    animation = FuncAnimation(plot.figure, plot.update, interval=UPDATE_MS, cache_frame_data=False)
+    print(f"Listening for telemetry on UDP port {args.port}, close the window to stop.")
+    plt.show()
+    if recorder:
+        recorder.close(receiver.names)
+        print(f"Samples recorded to {args.record}, run `python3 analyze_samples.py {args.record}` to analyze them.")
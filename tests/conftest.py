@@ -0,0 +1,31 @@
+"""
+Unit test configuration. Like the benchmarks, the tests run against the simulated brick from
+utils.simulation, so they can run on any computer.
+
+pipenv run python3 -m pytest tests
+"""
+
+from __future__ import annotations  # not required in Python 3.10+
+import os
+import signal
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "project"))
+
+from utils import simulation  # noqa: E402
+
+simulation.install()
+
+from utils import brick  # noqa: E402
+
+# utils.brick runs its own shutdown on Ctrl-C and exits, restore the default so pytest stops normally
+signal.signal(signal.SIGINT, signal.default_int_handler)
+
+
+@pytest.fixture
+def sim() -> brick.BrickPi3:
+    "Return the simulated brick, reset after the test."
+    yield brick.BP
+    brick.BP.sim_reset()
@@ -0,0 +1,57 @@
+"""
+Tests of the ring buffers of utils.acquisition, written and read in this process.
+"""
+
+from __future__ import annotations  # not required in Python 3.10+
+import struct
+
+import pytest
+
+from utils.acquisition import CHANNEL_HEADER, ChannelWriter, SharedDevice, channel_offset
+
+CAPACITY = 4
+
+
+@pytest.fixture
+def channel() -> tuple[ChannelWriter, SharedDevice]:
+    "Return the writer and reader of one channel of port 1, with CAPACITY samples, in a bytearray."
+    buffer = memoryview(bytearray(channel_offset(1, CAPACITY)))
+    CHANNEL_HEADER.pack_into(buffer, channel_offset(0, CAPACITY), 0, 0, b"1")
+    return ChannelWriter(buffer, 0, CAPACITY), SharedDevice(buffer, 0, CAPACITY)
+
+
+def write(writer: ChannelWriter, *timestamps: float):
+    "Write valid samples with the given timestamps as values."
+    for timestamp in timestamps:
+        writer.write(timestamp, 0, timestamp)
+
+
+def test_get_samples_returns_the_latest_oldest_first(channel):
+    writer, device = channel
+    assert device.port == "1"
+    assert device.get_samples(3) == []
+    write(writer, 0.0, 1.0, 2.0, 3.0, 4.0, 5.0)
+    assert [sample[0] for sample in device.get_samples(10)] == [2.0, 3.0, 4.0, 5.0]
+    assert device.get_samples(2) == [(4.0, 0, 4.0), (5.0, 0, 5.0)]
+
+
+@pytest.mark.parametrize("written, in_progress, latest", [
+    ((6.0,), False, [3.0, 4.0, 5.0]),
+    ((6.0,), True, [4.0, 5.0]),  # 7 is being written in the slot of 3
+    ((6.0, 7.0), False, [4.0, 5.0]),
+])
+def test_get_samples_drops_the_samples_overwritten_while_copied(channel, monkeypatch, written, in_progress, latest):
+    writer, device = channel
+    write(writer, 0.0, 1.0, 2.0, 3.0, 4.0, 5.0)
+    unpack = device._unpack
+
+    def unpack_then_write(slot: int):
+        "Copy the sample, and after the first one let the writer overwrite the slots of the oldest ones."
+        sample = unpack(slot)
+        if sample[0] == 2.0:
+            write(writer, *written)
+            if in_progress:
+                struct.pack_into("<Q", writer.buffer, writer.offset, writer.sequence + 1)
+        return sample
+    monkeypatch.setattr(device, "_unpack", unpack_then_write)
+    assert [sample[0] for sample in device.get_samples(CAPACITY)] == latest
@@ -0,0 +1,72 @@
+"""
+Tests of the retry and circuit breaker policy of Sensor.read().
+"""
+
+from __future__ import annotations  # not required in Python 3.10+
+
+from utils.brick import CircuitBreaker, EV3UltrasonicSensor, Sensor
+
+
+def fail(breaker: CircuitBreaker, times: int, now: float = 0.0):
+    "Record failed reads at the given time."
+    for _ in range(times):
+        breaker.failed(now)
+
+
+def test_opens_after_threshold_failures_in_a_row():
+    breaker = CircuitBreaker(failure_threshold=3, open_time=0.1)
+    fail(breaker, 2)
+    assert not breaker.is_open(0.0)
+    fail(breaker, 1)
+    assert breaker.is_open(0.0)
+    assert breaker.is_open(0.099)
+    assert not breaker.is_open(0.1)  # one probe read is allowed
+    assert breaker.times_opened == 1
+
+
+def test_success_resets_the_failure_count():
+    breaker = CircuitBreaker(failure_threshold=3)
+    fail(breaker, 2)
+    breaker.succeeded()
+    fail(breaker, 2)
+    assert not breaker.is_open(0.0)
+
+
+def test_failed_probe_doubles_the_open_time_up_to_the_maximum():
+    breaker = CircuitBreaker(failure_threshold=2, open_time=0.1, max_open_time=0.3)
+    fail(breaker, 2, 0.0)
+    assert breaker.open_until == 0.1
+    fail(breaker, 1, 0.1)  # failed probe
+    assert breaker.open_until == 0.1 + 0.2
+    fail(breaker, 1, 0.3)
+    assert breaker.open_until == 0.3 + 0.3
+    fail(breaker, 1, 0.6)
+    assert breaker.open_until == 0.6 + 0.3
+    assert breaker.times_opened == 4
+
+
+def test_successful_probe_closes_the_circuit():
+    breaker = CircuitBreaker(failure_threshold=2, open_time=0.1)
+    fail(breaker, 2, 0.0)
+    fail(breaker, 1, 0.1)
+    breaker.succeeded()
+    fail(breaker, 1, 0.5)
+    assert not breaker.is_open(0.5)
+    fail(breaker, 1, 0.5)
+    assert breaker.open_until == 0.5 + 0.1  # back to the initial open time
+
+
+def test_read_stops_using_the_bus_while_open(sim):
+    sensor = EV3UltrasonicSensor(1)
+    sensor.wait_ready()
+    sensor.breaker = CircuitBreaker(retries=1, failure_threshold=2, open_time=60.0)
+    sim.sim_set_fault_rate(sensor.port, 1.0)
+    transfers = sim.transfers
+    assert sensor.read().status == Sensor.Status.NO_DATA
+    assert sim.transfers == transfers + 1  # NO_DATA is not retried
+    assert sensor.read().status == Sensor.Status.NO_DATA
+    timestamp = sensor.reading.timestamp
+    transfers = sim.transfers
+    assert sensor.read().status == Sensor.Status.CIRCUIT_OPEN
+    assert sim.transfers == transfers
+    assert sensor.reading.timestamp == timestamp
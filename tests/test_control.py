@@ -0,0 +1,89 @@
+"""
+Tests of the control socket, in particular that the TCP port only runs commands signed with the secret.
+"""
+
+from __future__ import annotations  # not required in Python 3.10+
+from threading import Thread
+import json
+import socket
+
+import pytest
+
+from utils import control, simulation
+
+SECRET = "correct horse"
+
+
+@pytest.fixture
+def probes(monkeypatch) -> list[str]:
+    "Replace the commands with a probe that records its calls, so no test stops or resets anything."
+    calls = []
+    monkeypatch.setattr(control, "COMMANDS", {"probe": lambda: calls.append("probe") or {"probed": True}})
+    return calls
+
+
+@pytest.fixture
+def tcp_port() -> int:
+    "Return the port of a TCP control server with the secret, on the loopback interface."
+    server = control.ControlTCPServer(("127.0.0.1", 0), control.ControlHandler)
+    server.secret = SECRET
+    Thread(target=server.serve_forever, args=(control.POLL_INTERVAL,), daemon=True).start()
+    yield server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+def exchange(port: int, line: str) -> tuple[str, dict | None]:
+    "Send a raw line after reading the nonce, and return the nonce and the answer, None if there is none."
+    with socket.create_connection(("127.0.0.1", port), control.TIMEOUT) as client:
+        answers = client.makefile("rb")
+        nonce = json.loads(answers.readline())["nonce"]
+        client.sendall(line.format(nonce=nonce).encode() + b"\n")
+        answer = answers.readline()
+    return nonce, json.loads(answer) if answer else None
+
+
+def test_signed_command_is_run(probes, tcp_port):
+    answer = control.send_command("probe", "127.0.0.1", tcp_port, secret=SECRET)
+    assert answer == {"ok": True, "probed": True}
+    assert probes == ["probe"]
+
+
+def test_bad_signature_is_rejected(probes, tcp_port):
+    assert control.send_command("probe", "127.0.0.1", tcp_port, secret="wrong") == {
+        "ok": False, "error": "Bad signature."}
+    assert probes == []
+
+
+def test_unsigned_command_is_rejected(probes, tcp_port):
+    _, answer = exchange(tcp_port, "probe")
+    assert answer == {"ok": False, "error": "Bad signature."}
+    assert probes == []
+
+
+def test_signature_of_another_connection_is_rejected(probes, tcp_port):
+    nonce, _ = exchange(tcp_port, "probe {nonce}")  # any line, to get a nonce
+    _, answer = exchange(tcp_port, f"probe {control.sign(SECRET, nonce, 'probe')}")
+    assert answer == {"ok": False, "error": "Bad signature."}
+    assert probes == []
+
+
+def test_no_tcp_server_without_secret(monkeypatch, tmp_path):
+    monkeypatch.setattr(simulation, "is_installed", lambda: False)
+    monkeypatch.delenv(control.SECRET_VARIABLE, raising=False)
+    with socket.socket() as free:
+        free.bind(("127.0.0.1", 0))
+        port = free.getsockname()[1]
+    path = str(tmp_path / "control.sock")
+    control.start(path, port)
+    try:
+        assert [server.server_address for server in control._servers] == [path]
+        assert control.send_command("status", "127.0.0.1", port, secret="") is None
+        assert control.send_command("status", path=path)["ok"]
+    finally:
+        control.close()
+
+
+def test_no_server_on_simulated_brick(tmp_path):
+    control.start(str(tmp_path / "control.sock"), 0, SECRET)
+    assert control._servers == []
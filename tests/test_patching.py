@@ -0,0 +1,54 @@
+"""
+Tests of utils.patching, through the metrics and tracing tools that both wrap the methods of utils.brick.
+"""
+
+from __future__ import annotations  # not required in Python 3.10+
+import time
+
+import pytest
+
+from utils import brick, control, metrics, patching, shutdown, simulation, tracing
+
+# Attributes that both tools, or only one of them, wrap. spi_transfer_array is inherited from SimBrickPi3
+PATCHED = [(brick.BrickPi3, "spi_transfer_array"), (brick.Brick, "read_sensor"), (brick.Sensor, "read"),
+           (brick.Sensor, "get_value"), (time, "sleep"), (shutdown, "sleep"), (control, "sleep")]
+
+
+@pytest.fixture
+def originals() -> dict[tuple[object, str], object]:
+    "Return the original attributes, None if inherited, and disable both tools after the test."
+    yield {(owner, attribute): owner.__dict__.get(attribute) for owner, attribute in PATCHED}
+    metrics.disable()
+    tracing.disable()
+    metrics.reset()
+    tracing.reset()
+
+
+def test_tools_are_removed_in_any_order(sim, originals):
+    metrics.enable()
+    tracing.enable()
+    assert all(owner.__dict__.get(attribute) is not original
+               for (owner, attribute), original in originals.items())
+
+    metrics.disable()
+    assert brick.Brick.read_sensor is not originals[(brick.Brick, "read_sensor")]  # still traced
+    assert brick.Sensor.get_value is originals[(brick.Sensor, "get_value")]  # only measured
+    sensor = brick.EV3UltrasonicSensor(1)
+    sensor.read()
+    assert "Sensor.read" not in metrics.snapshot()["operations"]
+    assert any(event["name"] == "read_sensor" for event in tracing.chrome_trace()["traceEvents"])
+
+    tracing.disable()
+    assert all(owner.__dict__.get(attribute) is original
+               for (owner, attribute), original in originals.items())
+    assert brick.Brick.spi_transfer_array is simulation.SimBrickPi3.spi_transfer_array
+    assert patching._patches == {}
+
+
+def test_same_tool_twice_is_removed_once(originals):
+    wrap = lambda function: lambda *args: function(*args)
+    patching.patch("test", time, "sleep", wrap)
+    patching.patch("test", time, "sleep", wrap)
+    patching.unpatch("test")
+    assert time.sleep is originals[(time, "sleep")]
+    assert patching._patches == {}
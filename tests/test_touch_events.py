@@ -0,0 +1,57 @@
+"""
+Tests of the debouncing of utils.touch_events, sampling the simulated touch sensor at chosen times.
+"""
+
+from __future__ import annotations  # not required in Python 3.10+
+from queue import Queue
+
+import pytest
+
+from utils import touch_events
+from utils.brick import TouchSensor
+from utils.touch_events import TouchEvent, TouchPoller
+
+
+@pytest.fixture
+def touch(sim, monkeypatch):
+    """
+    Return a function that samples the touch sensor on port 1 with the given value at the given time,
+    and returns the events dispatched so far. The poller thread is not started.
+    """
+    sensor = TouchSensor(1)
+    sensor.wait_ready()
+    poller = TouchPoller(debounce=0.02)
+    state = touch_events._TouchState(sensor)
+    events = Queue()
+    state.queues.append(events)
+    poller.states = [state]
+    clock = [0.0]
+    monkeypatch.setattr(touch_events, "monotonic", lambda: clock[0])
+
+    def sample(value: int, t: float) -> list[TouchEvent]:
+        sim.sim_set_value(sensor.port, value)
+        clock[0] = t
+        poller._update(state)
+        return [events.get() for _ in range(events.qsize())]
+    return sample
+
+
+def test_short_bounce_is_rejected(touch):
+    assert touch(0, 0.00) == []
+    assert touch(1, 0.01) == []
+    assert touch(1, 0.02) == []  # pressed for 10 ms, shorter than the debounce time
+    assert touch(0, 0.03) == []
+    assert touch(0, 0.10) == []
+
+
+def test_press_and_release_last_the_debounce_time(touch):
+    touch(0, 0.00)
+    touch(1, 0.10)
+    [press] = touch(1, 0.13)
+    assert (press.kind, press.timestamp) == (TouchEvent.PRESS, 0.10)
+    touch(0, 0.50)
+    assert touch(1, 0.51) == []  # released for 10 ms, a bounce
+    assert touch(1, 0.60) == []
+    touch(0, 0.70)
+    [release] = touch(0, 0.73)
+    assert (release.kind, release.timestamp, release.duration) == (TouchEvent.RELEASE, 0.70, pytest.approx(0.60))